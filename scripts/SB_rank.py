@@ -1,78 +1,23 @@
-import os
 import pandas as pd
-import torch
-from speechbrain.inference.classifiers import EncoderClassifier
+
+from lid_posteriors import load_or_score_lid_posteriors
 
 # ① 音声ファイルが保存されているディレクトリ
 base_dir = "/work/data/IndicSUPERB/kb_data_clean_m4a/hindi/train/audio"
 
-# ② CSVファイルのパス（各行の "data" 列に複数のファイル情報が記載されている前提）
-csv_path = "/work/result/hindi_21sec_20000_train.csv"  # ご自身のCSVファイルのパスに変更してください
-
-# ③ CSVを読み込む
-df = pd.read_csv(csv_path)
+# ② グループ表のパス（group_id, path, num_frames）
+groups_path = "/work/result/hindi_21sec_20000_train.parquet"  # ご自身のグループ表のパスに変更してください
 
-# ④ SpeechBrainの言語識別モデルをロード
-language_id = EncoderClassifier.from_hparams(
-    source="speechbrain/lang-id-voxlingua107-ecapa",
-    savedir="tmp",
-    run_opts={"device": "cuda"}
-)
+# ③ 全グループの107言語の対数事後確率（float16）を一度だけ算出して保存
+#    保存済みならモデルを動かさずに読み込む（確率・ランク・他言語のスコアはこのファイルから導出）
+posteriors = load_or_score_lid_posteriors("/work/result/lid_hindi_21sec_20000_train.npz", groups_path, base_dir)
 
-# ⑤ パンジャビ語のラベルのインデックスを取得
-num_langs = 107  # VoxLingua107は107言語対応
-all_ids = torch.arange(num_langs)
-all_labels = language_id.hparams.label_encoder.decode_ndim(all_ids)
-# ラベル一覧例: "pa: Panjabi" を利用
+# ④ パンジャビ語のランクを導出（パンジャビ語のスコアより大きい言語の数 + 1、1位が最も高い）
 panjabi_label = "pa: Panjabi"
-if panjabi_label not in all_labels:
-    raise ValueError(f"{panjabi_label} がラベル一覧に見つかりません。")
-idx_panjabi = all_labels.index(panjabi_label)
-print("Panjabiのインデックス:", idx_panjabi)
-
-# ⑥ 各インデックスのデータに対して、複数の音声ファイルを連結しパンジャビ語のランクを算出
-results = []
-for idx, row in df.iterrows():
-    data_str = row["data"]
-    # 改行ごとに分割（ヘッダー行などwavが含まれない行はスキップ）
-    lines = data_str.strip().splitlines()
-    
-    combined_signal = None
-    for line in lines:
-        if "wav" not in line:
-            continue
-        tokens = line.strip().split()
-        if len(tokens) < 2:
-            continue
-        filename = tokens[1]
-        file_path = os.path.join(base_dir, filename)
-        try:
-            signal = language_id.load_audio(file_path)
-        except Exception as e:
-            print(f"{file_path} の読み込みエラー: {e}")
-            continue
-        # 信号を連結（同じサンプルレートであることが前提）
-        if combined_signal is None:
-            combined_signal = signal
-        else:
-            combined_signal = torch.cat([combined_signal, signal], dim=-1)
-    
-    if combined_signal is not None:
-        prediction = language_id.classify_batch(combined_signal)
-        scores_tensor = prediction[0]  # shape: (1, 107)
-        scores_1d = scores_tensor.squeeze(0)
-        # パンジャビ語のスコアより大きい言語の数を数える
-        # （スコアが高いほど可能性が高いので、1位が最も高い）
-        rank = (scores_1d > scores_1d[idx_panjabi]).sum().item() + 1
-    else:
-        rank = None
-    results.append(rank)
-    print(f"インデックス {idx} の Panjabi のランク: {rank}")
-
-# ⑦ 結果のみの新しいDataFrameを作成（列名を "rank" とする）
-df_rank = pd.DataFrame({'rank': results})
+print("Panjabiのインデックス:", posteriors.label_index(panjabi_label))
+df_rank = pd.DataFrame({'rank': posteriors.rank(panjabi_label)})
 
-# ⑧ CSVとして保存（行番号を含める形式の場合）
+# ⑤ CSVとして保存（行番号を含める形式の場合）
 output_csv = "result/rank_hindi.csv"
 df_rank.to_csv(output_csv, index=True)
 print("新しいCSVファイルを保存しました:", output_csv)
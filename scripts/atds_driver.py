@@ -0,0 +1,167 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+# Groups between two throughput reports
+REPORT_EVERY = 50
+
+class ScoreLedger:
+    """
+    Append-only SQLite ledger of the groups one worker has scored. Every
+    group is committed as soon as it is scored, so a crash loses at most
+    the group in flight.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scores "
+                          "(group_id TEXT PRIMARY KEY, atds REAL, piece_counts_sum INTEGER, seconds REAL)")
+        self.conn.commit()
+
+    def append(self, group_id, atds, piece_counts_sum, seconds):
+        self.conn.execute("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                          (str(group_id), atds, piece_counts_sum, seconds))
+        self.conn.commit()
+
+def read_ledgers(ledger_dir):
+    """
+    Returns:
+    pd.DataFrame: atds, piece_counts_sum and seconds of every scored group, indexed by group_id
+    """
+    frames = []
+    for path in sorted(glob.glob(os.path.join(ledger_dir, "shard-*.sqlite"))):
+        with sqlite3.connect(path) as conn:
+            frames.append(pd.read_sql_query("SELECT * FROM scores", conn))
+    if not frames:
+        return pd.DataFrame(columns=["atds", "piece_counts_sum", "seconds"], index=pd.Index([], name="group_id"))
+    return pd.concat(frames).drop_duplicates("group_id", keep="last").set_index("group_id")
+
+def load_pipeline(checkpoint_path, km_model, spm_model, reference, layer=12, device='cuda', cache_dir=None):
+    """
+    Load everything a worker scores with: the truncated wav2vec2 model, VAD,
+    k-means codebook, unit tokenizer and reference histogram.
+
+    Returns:
+    ATDSPipeline
+    """
+    import joblib
+    import sentencepiece as spm
+    import torch
+
+    from atds_pipeline import ATDSPipeline
+    from embedding_cache import EmbeddingCache
+    from embedding_engine import get_model, truncate_encoder
+    from reference_histogram import ReferenceHistogram
+
+    ref = ReferenceHistogram(reference)
+    if not ref.matches(spm_model, km_model):
+        raise ValueError(f"{reference} was built with a different SentencePiece or k-means model")
+
+    model = truncate_encoder(get_model(checkpoint_path, device), layer)
+    vad_model, vad_utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False, onnx=False)
+    embedding_cache = None
+    if cache_dir is not None:
+        embedding_cache = EmbeddingCache(cache_dir, checkpoint_path)
+
+    return ATDSPipeline(model, vad_model, vad_utils[0], joblib.load(km_model), spm.SentencePieceProcessor(model_file=spm_model),
+                        ref.histogram, embedding_cache=embedding_cache, layer=layer, device=device)
+
+# Per worker process, set by _init_worker
+_pipeline = None
+_ledger = None
+_wav_dir = None
+
+def _init_worker(worker_ids, devices, ledger_dir, wav_dir, pipeline_factory, factory_kwargs):
+    global _pipeline, _ledger, _wav_dir
+    with worker_ids.get_lock():
+        worker_id = worker_ids.value
+        worker_ids.value += 1
+
+    _pipeline = pipeline_factory(device=devices[worker_id % len(devices)], **factory_kwargs)
+    _ledger = ScoreLedger(os.path.join(ledger_dir, f"shard-{worker_id}.sqlite"))
+    _wav_dir = wav_dir
+
+def _score_group(group_id, wav_files):
+    start = time.perf_counter()
+    atds, counts_sum = _pipeline.score_group(wav_files, _wav_dir)
+    _ledger.append(group_id, atds, counts_sum, time.perf_counter() - start)
+    return group_id, atds, counts_sum
+
+def run_sharded(groups, wav_dir, ledger_dir, pipeline_factory=load_pipeline, factory_kwargs=None,
+                num_workers=1, devices=('cuda',)):
+    """
+    Score groups of wav files in num_workers processes. Each worker loads its
+    own pipeline with pipeline_factory(device=..., **factory_kwargs), devices
+    being handed out round-robin, and appends its results to its own shard
+    of the ledger in ledger_dir. Groups already in the ledger are skipped,
+    so an interrupted run is resumed by running it again.
+
+    Parameters:
+    groups (dict): group id -> list of wav files (e.g. group_table.grouped_paths)
+
+    Returns:
+    pd.DataFrame: ledger rows of the groups, in the order of groups
+    """
+    if num_workers < 1 or not devices:
+        raise ValueError(f"Need at least one worker and one device, got {num_workers} workers on {list(devices)}")
+    os.makedirs(ledger_dir, exist_ok=True)
+    done = set(read_ledgers(ledger_dir).index)
+    todo = [(group_id, wav_files) for group_id, wav_files in groups.items() if str(group_id) not in done]
+    print(f"{len(groups) - len(todo)} of {len(groups)} groups already scored, {len(todo)} to go")
+
+    if todo:
+        # spawn, since CUDA can not be used from forked workers
+        ctx = multiprocessing.get_context("spawn")
+        worker_ids = ctx.Value("i", 0)
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(worker_ids, list(devices), ledger_dir, wav_dir,
+                                           pipeline_factory, factory_kwargs or {})) as executor:
+            futures = [executor.submit(_score_group, group_id, wav_files) for group_id, wav_files in todo]
+            start = time.perf_counter()
+            for num_done, future in enumerate(as_completed(futures), 1):
+                group_id, atds, counts_sum = future.result()
+                if num_done % REPORT_EVERY == 0 or num_done == len(todo):
+                    elapsed = time.perf_counter() - start
+                    print(f"{num_done}/{len(todo)} groups, {num_done / elapsed:.2f} groups/s "
+                          f"(last: group {group_id}, ATDS = {atds:.4f}, Sum = {counts_sum})")
+
+    return read_ledgers(ledger_dir).reindex([str(group_id) for group_id in groups])
+
+def write_results(scores_df, atds_csv, counts_csv=None):
+    """Write the ledger in the layout of the sequential loop: rounded ATDS, and piece counts sums."""
+    scores_df[["atds"]].round(4).to_csv(atds_csv)
+    if counts_csv is not None:
+        scores_df[["piece_counts_sum"]].to_csv(counts_csv)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score ATDS of donor groups in parallel worker processes, resumable')
+    parser.add_argument('--groups', required=True, type=str, help='group table as written by run_get_multiple_data_df.py')
+    parser.add_argument('--wav-dir', required=True, type=str)
+    parser.add_argument('--ledger-dir', required=True, type=str, help='per-worker SQLite ledgers; rerun with the same dir to resume')
+    parser.add_argument('--checkpoint-path', required=True, type=str)
+    parser.add_argument('--km-model', required=True, type=str)
+    parser.add_argument('--spm-model', required=True, type=str)
+    parser.add_argument('--reference', required=True, type=str, help='reference histogram .npz')
+    parser.add_argument('--layer', default=12, type=int)
+    parser.add_argument('--cache-dir', default=None, type=str)
+    parser.add_argument('--num-workers', default=1, type=int)
+    parser.add_argument('--devices', default='cuda', type=str, help='comma separated, e.g. cuda:0,cuda:1 or cpu')
+    parser.add_argument('--output-csv', required=True, type=str)
+    parser.add_argument('--counts-csv', default=None, type=str)
+    args = parser.parse_args()
+
+    from group_table import load_group_table, grouped_paths
+
+    scores_df = run_sharded(grouped_paths(load_group_table(args.groups)), args.wav_dir, args.ledger_dir,
+                            factory_kwargs=dict(checkpoint_path=args.checkpoint_path, km_model=args.km_model,
+                                                spm_model=args.spm_model, reference=args.reference,
+                                                layer=args.layer, cache_dir=args.cache_dir),
+                            num_workers=args.num_workers, devices=args.devices.split(','))
+    write_results(scores_df, args.output_csv, args.counts_csv)
+    print(f"Saved {scores_df.atds.notna().sum()} scores to {args.output_csv}")
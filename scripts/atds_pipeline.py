@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from embedding_engine import iter_speech_embeddings, align_speech_codes
+from kmeans_engine import CentroidAssigner
+from atds_scoring import piece_histogram, atds_scores
+from unit_strings import utterance_offsets, unit_strings, encode_units
+
+def reference_histogram_from_clusters(clustered_parquet, sp):
+    """Piece histogram of a reference language from its clustered parquet (wav_file, cluster_id)."""
+    clusters_df = pd.read_parquet(clustered_parquet, columns=["wav_file", "cluster_id"])
+    _, cluster_ids, offsets = utterance_offsets(clusters_df, keys=["wav_file"])
+    piece_ids, _ = encode_units(sp, unit_strings(cluster_ids, offsets))
+    return piece_histogram(piece_ids, sp.get_piece_size())
+
+class ATDSPipeline:
+    """
+    In-memory extract -> cluster -> tokenize -> score pipeline.
+
+    The wav2vec2 model, VAD, k-means codebook, SentencePiece processor and the
+    reference piece histogram are loaded once. Each group then only runs its own
+    audio through the stages, without writing embeddings or cluster ids to
+    disk.
+    """
+
+    def __init__(self, model, vad_model, get_speech_timestamps, km_model, sp, ref_histogram,
+                 embedding_cache=None, layer=12, device='cuda'):
+        self.model = model
+        self.vad_model = vad_model
+        self.get_speech_timestamps = get_speech_timestamps
+        self.assigner = CentroidAssigner.from_model(km_model)
+        self.sp = sp
+        self.ref_histogram = ref_histogram
+        self.embedding_cache = embedding_cache
+        self.layer = layer
+        self.device = device
+
+    def cluster_utterances(self, wav_files, wav_dir, num_frames=None):
+        """
+        Returns:
+        dict: wav_file -> cluster ids of its speech codes
+        """
+        extracted = iter_speech_embeddings(self.model, wav_dir, wav_files, self.get_speech_timestamps, self.vad_model,
+                                           num_frames=num_frames, layers=(self.layer,), device=self.device,
+                                           cache=self.embedding_cache)
+        utt_wav_files = []
+        utt_embeddings = []
+        for wav_file, speech_timestamps, sample_rate, num_samples, layer_embeddings in extracted:
+            _, _, speech_embeddings = align_speech_codes(speech_timestamps, sample_rate, num_samples, layer_embeddings)
+            utt_wav_files.append(wav_file)
+            utt_embeddings.append(speech_embeddings[:, 0])
+
+        if not utt_embeddings:
+            return {}
+
+        # One assignment call for the whole group, split back per utterance
+        cluster_ids = self.assigner.predict(np.concatenate(utt_embeddings))
+        offsets = np.cumsum([len(emb) for emb in utt_embeddings])[:-1]
+        return dict(zip(utt_wav_files, np.split(cluster_ids, offsets)))
+
+    def encode_utterances(self, utt_cluster_ids):
+        """
+        SentencePiece ids of each utterance's unit string.
+
+        Returns:
+        tuple: (flat piece ids, offsets of each utterance in utt_cluster_ids order plus the total)
+        """
+        offsets = np.concatenate([[0], np.cumsum([len(ids) for ids in utt_cluster_ids.values()])])
+        cluster_ids = np.concatenate(list(utt_cluster_ids.values())) if utt_cluster_ids else np.empty(0, dtype=np.int32)
+        return encode_units(self.sp, unit_strings(cluster_ids, offsets))
+
+    def score_group(self, wav_files, wav_dir, num_frames=None):
+        """
+        Returns:
+        tuple: (ATDS against the reference, total number of pieces in the group)
+        """
+        piece_ids, _ = self.encode_utterances(self.cluster_utterances(wav_files, wav_dir, num_frames))
+        histogram = piece_histogram(piece_ids, self.sp.get_piece_size())
+        return float(atds_scores(histogram[None], self.ref_histogram)[0]), int(histogram.sum())
@@ -0,0 +1,56 @@
+import numpy as np
+import scipy.sparse as sparse
+
+def piece_histogram(piece_ids, vocab_size):
+    """Count of every piece id in the vocab, as a dense int64 vector."""
+    return np.bincount(np.asarray(piece_ids, dtype=np.int64), minlength=vocab_size)
+
+def piece_histograms(piece_ids, offsets, vocab_size):
+    """
+    Piece counts of many groups (or utterances) at once.
+
+    Parameters:
+    piece_ids (np.ndarray): piece ids of all groups, concatenated
+    offsets (np.ndarray): start of each group in piece_ids, plus the total length at the end
+    vocab_size (int): number of pieces in the SentencePiece vocab
+
+    Returns:
+    scipy.sparse.csr_matrix: (num_groups, vocab_size) int64 counts
+    """
+    offsets = np.asarray(offsets)
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    counts = sparse.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, np.asarray(piece_ids, dtype=np.int64))),
+                               shape=(len(offsets) - 1, vocab_size))
+    # Converting to CSR sums the duplicate (group, piece) entries
+    return counts.tocsr()
+
+def atds_scores(histograms, ref_histogram):
+    """
+    ATDS of every row of histograms against the reference histogram.
+
+    Same arithmetic as make_piece_freqs_matrix + make_ATDS_matrix: both sides
+    are divided by their most frequent piece's count, then scored with
+    1 - scipy.spatial.distance.cosine. The rows are scored together with one
+    sparse matrix-vector product. Empty rows score nan.
+
+    Parameters:
+    histograms (scipy.sparse matrix or np.ndarray): (num_groups, vocab_size) piece counts
+    ref_histogram (np.ndarray): (vocab_size,) piece counts of the reference language
+
+    Returns:
+    np.ndarray: float64 ATDS of each group
+    """
+    histograms = sparse.csr_matrix(histograms, dtype=np.float64)
+    histograms.sum_duplicates()
+    ref = ref_histogram / ref_histogram.max()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        row_max = histograms.max(axis=1).toarray().ravel()
+        histograms.data /= np.repeat(row_max, np.diff(histograms.indptr))
+
+        uv = histograms @ ref
+        uu = np.asarray(histograms.multiply(histograms).sum(axis=1)).ravel()
+        vv = np.dot(ref, ref)
+        dist = np.clip(1.0 - uv / np.sqrt(uu * vv), 0.0, 2.0)
+
+    return 1 - dist
@@ -0,0 +1,96 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from embedding_store import EmbeddingParquetWriter, embedding_cols
+
+# wav2vec2 emits one code every 20 ms
+CODES_PER_SECOND = 50
+
+def fake_utterances(num_hours, dim, utt_seconds=10.0, seed=0):
+    """Yield (wav_file, start_times, end_times, embeddings) for num_hours of synthetic speech."""
+    rng = np.random.default_rng(seed)
+    num_codes = int(utt_seconds * CODES_PER_SECOND)
+    emb = rng.standard_normal((num_codes, dim)).astype(np.float32)
+    start_times = np.arange(num_codes) / CODES_PER_SECOND
+    end_times = start_times + 1 / CODES_PER_SECOND
+
+    for i in range(int(num_hours * 3600 / utt_seconds)):
+        yield f"utt{i:07}.wav", start_times, end_times, emb
+
+def write_concat(utterances, output_parquet, dim):
+    """The original getembeddings accumulation: pd.concat once per wav."""
+    cols = embedding_cols(dim)
+    final_speech_df = pd.DataFrame(columns=["wav_file", "code_start_time", "code_end_time"] + cols)
+    for wav_file, start_times, end_times, emb in utterances:
+        cur_speech_df = pd.DataFrame(emb, columns=cols)
+        cur_speech_df.insert(0, "code_end_time", end_times)
+        cur_speech_df.insert(0, "code_start_time", start_times)
+        cur_speech_df.insert(0, "wav_file", wav_file)
+        final_speech_df = pd.concat([final_speech_df, cur_speech_df], ignore_index=True, sort=False)
+    final_speech_df.to_parquet(output_parquet)
+
+def write_streaming(utterances, output_parquet, dim):
+    with EmbeddingParquetWriter(output_parquet, dim=dim) as writer:
+        for wav_file, start_times, end_times, emb in utterances:
+            writer.write(wav_file, start_times, end_times, emb)
+
+def measure(write_fn, num_hours, dim, tmp_dir):
+    """
+    Return (seconds, peak MiB) of writing num_hours of synthetic embeddings.
+    Peak memory is the traced Python/NumPy heap plus arrow's own pool, so each
+    call should run in a fresh process.
+    """
+    output_parquet = os.path.join(tmp_dir, f"{write_fn.__name__}_{num_hours}h.parquet")
+    pool = pa.default_memory_pool()
+
+    tracemalloc.start()
+    begin = time.perf_counter()
+    write_fn(fake_utterances(num_hours, dim), output_parquet, dim)
+    elapsed = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak += pool.max_memory()
+    os.remove(output_parquet)
+    return elapsed, peak / 2**20
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark pd.concat accumulation against the streaming parquet writer')
+    parser.add_argument('--hours', nargs='+', default=[1, 5, 20], type=float)
+    parser.add_argument('--dim', default=1024, type=int,
+                help='embedding dimension (default=1024; lower it for a quick run)')
+    parser.add_argument('--concat-max-hours', default=None, type=float,
+                help='skip the pd.concat baseline above this many hours')
+    parser.add_argument('--output-csv', default=None, type=str)
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_hours in args.hours:
+            for method, write_fn in [("concat", write_concat), ("streaming", write_streaming)]:
+                if method == "concat" and args.concat_max_hours is not None and num_hours > args.concat_max_hours:
+                    continue
+                try:
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        elapsed, peak_mib = executor.submit(measure, write_fn, num_hours, args.dim, tmp_dir).result()
+                except BrokenProcessPool:
+                    # Typically the OOM killer; record it and carry on with the other sizes
+                    print(f"{method:>9} {num_hours:>5}h: killed (out of memory?)")
+                    rows.append({"method": method, "hours": num_hours, "seconds": np.nan, "peak_mib": np.nan})
+                    continue
+                rows.append({"method": method, "hours": num_hours, "seconds": elapsed, "peak_mib": peak_mib})
+                print(f"{method:>9} {num_hours:>5}h: {elapsed:8.2f} s, peak {peak_mib:9.1f} MiB")
+
+    results_df = pd.DataFrame(rows)
+    print(results_df.pivot(index="hours", columns="method", values=["seconds", "peak_mib"]))
+    if args.output_csv:
+        results_df.to_csv(args.output_csv, index=False)
@@ -0,0 +1,82 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from group_table import load_group_table, grouped_paths, group_frames, group_rows
+from lid_cache import AGGREGATE_MODES, LIDCache, cached_group_log_probs
+from lid_engine import lid_log_probs
+from lid_posteriors import LID_SOURCE, load_language_id, classifier_labels
+
+def agreement(reference, composed, target_index):
+    """
+    How close composed group log-posteriors are to classifying the concatenated audio.
+
+    Returns:
+    dict: target probability MAE and correlation, top-1 and target rank agreement, and the mean and
+          worst per-language rank (Spearman) correlation across groups, over groups scored by both
+    """
+    scored = ~np.isnan(reference[:, 0]) & ~np.isnan(composed[:, 0])
+    reference, composed = reference[scored], composed[scored]
+    ref_prob, comp_prob = np.exp(reference[:, target_index]), np.exp(composed[:, target_index])
+    ref_rank = (reference > reference[:, [target_index]]).sum(axis=1) + 1
+    comp_rank = (composed > composed[:, [target_index]]).sum(axis=1) + 1
+    # For every language, how alike the two methods order the groups by it (what sort_by_SB selects on)
+    lang_rank_corr = pd.DataFrame(reference).corrwith(pd.DataFrame(composed), method="spearman").to_numpy()
+    return {
+        "groups": int(scored.sum()),
+        "target_prob_mae": float(np.abs(ref_prob - comp_prob).mean()),
+        "target_prob_corr": float(np.corrcoef(ref_prob, comp_prob)[0, 1]),
+        "top1_agreement": float((reference.argmax(axis=1) == composed.argmax(axis=1)).mean()),
+        "target_rank_agreement": float((ref_rank == comp_rank).mean()),
+        "lang_rank_corr_mean": float(np.nanmean(lang_rank_corr)),
+        "lang_rank_corr_min": float(np.nanmin(lang_rank_corr)),
+    }
+
+def bench_lid_aggregation(groups_path, base_dir, num_groups, target, device=None, source=LID_SOURCE):
+    language_id = load_language_id(device, source=source)
+    target_index = [label.split(":")[0] for label in classifier_labels(language_id)].index(target.split(":")[0])
+
+    group_table = load_group_table(groups_path)
+    groups = dict(list(grouped_paths(group_table).items())[:num_groups])
+    sample = group_rows(group_table, list(groups))
+    file_frames = dict(zip(sample.path, sample.num_frames))
+
+    rows = []
+    begin = time.perf_counter()
+    reference = lid_log_probs(language_id, groups, base_dir, group_frames(sample).loc[list(groups)].to_numpy())
+    rows.append({"method": "concat", "seconds": time.perf_counter() - begin})
+    print(f"{'concat':>20}: {rows[-1]['seconds']:8.2f} s")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = LIDCache(cache_dir, source)
+        for mode in AGGREGATE_MODES:
+            # the first pass fills the cache, the second only reads it
+            for state in ("cold", "warm") if mode == AGGREGATE_MODES[0] else ("warm",):
+                begin = time.perf_counter()
+                composed = cached_group_log_probs(language_id, groups, base_dir, cache, file_frames, mode=mode)
+                elapsed = time.perf_counter() - begin
+                rows.append({"method": f"{mode} ({state})", "seconds": elapsed, **agreement(reference, composed, target_index)})
+                print(f"{rows[-1]['method']:>20}: {elapsed:8.2f} s, {target} prob MAE {rows[-1]['target_prob_mae']:.4f}, "
+                      f"corr {rows[-1]['target_prob_corr']:.4f}, top-1 {rows[-1]['top1_agreement']:.3f}, "
+                      f"rank {rows[-1]['target_rank_agreement']:.3f}, per-language rank corr "
+                      f"{rows[-1]['lang_rank_corr_mean']:.4f} (min {rows[-1]['lang_rank_corr_min']:.4f})")
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark composing group LID from cached utterances against classifying concatenated audio')
+    parser.add_argument('--groups', required=True, type=str, help='group table')
+    parser.add_argument('--base-dir', required=True, type=str)
+    parser.add_argument('--num-groups', default=500, type=int)
+    parser.add_argument('--target', default='pa: Panjabi', type=str, help='label or language code (default: pa: Panjabi)')
+    parser.add_argument('--device', default=None, type=str)
+    parser.add_argument('--source', default=LID_SOURCE, type=str, help=f'classifier to load (default: {LID_SOURCE})')
+    parser.add_argument('--output-csv', default=None, type=str)
+    args = parser.parse_args()
+
+    results_df = bench_lid_aggregation(args.groups, args.base_dir, args.num_groups, args.target, args.device, args.source)
+    print(results_df.to_string(index=False))
+    if args.output_csv:
+        results_df.to_csv(args.output_csv, index=False)
@@ -0,0 +1,92 @@
+import argparse
+import os
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+from atds_driver import run_sharded, read_ledgers
+
+class StubPipeline:
+    """
+    Stands in for ATDSPipeline: scores a group from its file names alone and
+    logs every group it scored, so the check can count how often each group
+    was scored. Raises on the group starting with fail_on, like a crash.
+    """
+
+    def __init__(self, device, log_dir, fail_on=None):
+        self.device = device
+        self.log_path = os.path.join(log_dir, f"calls-{os.getpid()}.log")
+        self.fail_on = fail_on
+
+    def score_group(self, wav_files, wav_dir):
+        if wav_files[0] == self.fail_on:
+            raise RuntimeError(f"stub failure on {wav_files[0]}")
+        with open(self.log_path, "a") as f:
+            f.write(f"{wav_files[0]}\t{self.device}\n")
+        return expected_score(wav_files)
+
+def expected_score(wav_files):
+    return sum(len(wav_file) for wav_file in wav_files) / 1000, len(wav_files)
+
+def stub_pipeline(device, **kwargs):
+    return StubPipeline(device, **kwargs)
+
+def scored_calls(log_dir):
+    """How often each group was scored, over the call logs of all workers so far."""
+    calls = Counter()
+    for name in os.listdir(log_dir):
+        if name.startswith("calls-"):
+            with open(os.path.join(log_dir, name)) as f:
+                calls.update(line.split("\t")[0] for line in f)
+    return calls
+
+def check_atds_driver(num_groups, num_workers, seed=0):
+    """
+    Run run_sharded on CPU with a stub pipeline that fails on one group,
+    rerun it without the failure, then once more. The rerun must score
+    only the group missing from the ledger, and the last run nothing.
+    """
+    rng = np.random.default_rng(seed)
+    groups = {f"g{i}": [f"g{i}_utt{j}.wav" for j in range(rng.integers(1, 20))] for i in range(num_groups)}
+    failing = f"g{num_groups // 2}"
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        ledger_dir = os.path.join(work_dir, "ledger")
+        kwargs = dict(num_workers=num_workers, devices=["cpu"])
+
+        begin = time.perf_counter()
+        try:
+            run_sharded(groups, work_dir, ledger_dir, stub_pipeline,
+                        dict(log_dir=work_dir, fail_on=groups[failing][0]), **kwargs)
+            raise AssertionError("the stub failure did not reach run_sharded")
+        except RuntimeError as e:
+            print(f"first run stopped: {e}")
+        first_calls = scored_calls(work_dir)
+        if failing in read_ledgers(ledger_dir).index or sum(first_calls.values()) != num_groups - 1:
+            raise AssertionError(f"first run scored {sum(first_calls.values())} groups, expected all but {failing}")
+
+        scores_df = run_sharded(groups, work_dir, ledger_dir, stub_pipeline, dict(log_dir=work_dir), **kwargs)
+        rerun_calls = scored_calls(work_dir) - first_calls
+        if rerun_calls != Counter([groups[failing][0]]):
+            raise AssertionError(f"rerun scored {sum(rerun_calls.values())} groups, expected only {failing}")
+
+        run_sharded(groups, work_dir, ledger_dir, stub_pipeline, dict(log_dir=work_dir), **kwargs)
+        all_calls = scored_calls(work_dir)
+        if len(all_calls) != num_groups or max(all_calls.values()) != 1:
+            raise AssertionError("a group was scored more than once")
+
+        expected = np.array([expected_score(wav_files) for wav_files in groups.values()])
+        if list(scores_df.index) != list(groups) or not np.allclose(scores_df[["atds", "piece_counts_sum"]].to_numpy(np.float64), expected):
+            raise AssertionError("ledger scores differ from the stub's")
+    print(f"{num_groups} groups on {num_workers} CPU workers: resumed after a failure, every group scored once "
+          f"({time.perf_counter() - begin:.2f} s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check that run_sharded runs on CPU and resumes an interrupted run')
+    parser.add_argument('--num-groups', default=40, type=int)
+    parser.add_argument('--num-workers', default=2, type=int)
+    args = parser.parse_args()
+
+    check_atds_driver(args.num_groups, args.num_workers)
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import distance
+
+from atds_scoring import piece_histograms, atds_scores
+
+def make_piece_freqs_matrix(all_utts_df, target_lang):
+    """make_piece_freqs_matrix of atds_token.py, kept as the reference."""
+    piece_counts_matrix = all_utts_df \
+        .explode('utt_piece_ids')[['lang', 'utt_piece_ids']] \
+        .groupby('lang')['utt_piece_ids'] \
+        .value_counts() \
+        .to_frame('count') \
+        .reset_index() \
+        .pivot(index='utt_piece_ids', columns='lang', values='count') \
+        .fillna(0)
+
+    for c in piece_counts_matrix.columns:
+        piece_counts_matrix[c] /= piece_counts_matrix[c].max()
+
+    return piece_counts_matrix[[target_lang] + [c for c in piece_counts_matrix.columns if c != target_lang]]
+
+def pandas_atds(ref_piece_ids, group_piece_ids):
+    """ATDS of one group the way run_all computes it: pivot, then scipy cosine."""
+    all_utts_df = pd.DataFrame({"lang": ["ref", "group"], "utt_piece_ids": [list(ref_piece_ids), list(group_piece_ids)]})
+    piece_freqs_matrix = make_piece_freqs_matrix(all_utts_df, "ref")
+    return 1 - distance.cosine(piece_freqs_matrix["ref"].to_list(), piece_freqs_matrix["group"].to_list())
+
+def zipf_piece_ids(rng, num_pieces, vocab_size):
+    return np.minimum(rng.zipf(1.3, size=num_pieces) - 1, vocab_size - 1)
+
+def check_atds_scoring(num_groups, vocab_size, seed=0):
+    rng = np.random.default_rng(seed)
+    ref_piece_ids = rng.permutation(vocab_size)[zipf_piece_ids(rng, 200_000, vocab_size)]
+    group_sizes = rng.integers(0, 5_000, size=num_groups)
+    # A group without speech has no pieces at all
+    group_sizes[0] = 0
+    group_piece_ids = [rng.permutation(vocab_size)[zipf_piece_ids(rng, n, vocab_size)] for n in group_sizes]
+
+    begin = time.perf_counter()
+    with np.errstate(invalid="ignore"):
+        expected = np.array([pandas_atds(ref_piece_ids, piece_ids) if len(piece_ids) else np.nan for piece_ids in group_piece_ids])
+    pandas_seconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    offsets = np.concatenate([[0], np.cumsum(group_sizes)])
+    histograms = piece_histograms(np.concatenate(group_piece_ids), offsets, vocab_size)
+    actual = atds_scores(histograms, np.bincount(ref_piece_ids, minlength=vocab_size))
+    sparse_seconds = time.perf_counter() - begin
+
+    if not np.array_equal(np.isnan(expected), np.isnan(actual)):
+        raise AssertionError("empty groups differ")
+    max_diff = np.nanmax(np.abs(expected - actual))
+    rounded_diff = int((np.round(expected, 4) != np.round(actual, 4)).sum() - np.isnan(expected).sum())
+    print(f"{num_groups} groups: max |diff| {max_diff:.3g}, {rounded_diff} differ after rounding to 4 digits")
+    print(f"pandas + scipy: {pandas_seconds:.2f} s, sparse: {sparse_seconds:.3f} s")
+    if max_diff > 1e-12 or rounded_diff:
+        raise AssertionError("sparse ATDS differs from the pandas reference")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check sparse ATDS scoring against make_piece_freqs_matrix + make_ATDS_matrix')
+    parser.add_argument('--num-groups', default=300, type=int)
+    parser.add_argument('--vocab-size', default=10001, type=int)
+    args = parser.parse_args()
+
+    check_atds_scoring(args.num_groups, args.vocab_size)
@@ -0,0 +1,50 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchaudio
+
+import fairseq
+
+from embedding_engine import make_batches, forward_batch, forward_single
+
+def check_batched_embeddings(checkpoint_path, wav_dir, num_files, max_batch_frames, layers=(12,), atol=1e-3):
+    """
+    Compare batched extraction against the per-file path on CPU.
+
+    Returns:
+    float: max absolute difference over all files
+    """
+    models, _, _ = fairseq.checkpoint_utils.load_model_ensemble_and_task([checkpoint_path])
+    model = models[0]
+    model.eval()
+
+    wav_files = sorted(Path(wav_dir).glob("*.wav"))[:num_files]
+    wavs = [torchaudio.load(p)[0] for p in wav_files]
+
+    max_diff = 0.0
+    for batch in make_batches([wav.shape[1] for wav in wavs], max_batch_frames):
+        batched = forward_batch(model, [wavs[i] for i in batch], layers=layers, device='cpu')
+        for idx, emb in zip(batch, batched):
+            single = forward_single(model, wavs[idx], layers=layers, device='cpu')
+            if single.shape != emb.shape:
+                raise ValueError(f"{wav_files[idx].name}: shape {emb.shape} != {single.shape}")
+            diff = float(np.abs(single - emb).max())
+            max_diff = max(max_diff, diff)
+            print(f"{wav_files[idx].name}: batch of {len(batch)}, {emb.shape[0]} codes, max abs diff {diff:.2e}")
+
+    print(f"Max abs diff over {len(wavs)} files: {max_diff:.2e} ({'OK' if max_diff <= atol else 'NG'})")
+    return max_diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check that batched extraction matches per-file extraction on CPU')
+    parser.add_argument('--checkpoint-path', required=True, type=str)
+    parser.add_argument('--wav-dir', required=True, type=str)
+    parser.add_argument('--num-files', default=16, type=int)
+    parser.add_argument('--max-batch-frames', default=16_000 * 60, type=int)
+    parser.add_argument('--layers', nargs='+', default=[12], type=int)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    check_batched_embeddings(args.checkpoint_path, args.wav_dir, args.num_files, args.max_batch_frames, args.layers)
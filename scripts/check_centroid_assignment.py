@@ -0,0 +1,58 @@
+import argparse
+import time
+
+import joblib
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from embedding_store import load_embeddings
+from kmeans_engine import CentroidAssigner
+
+def synthetic_embeddings(num_rows, dim, num_clusters, seed=0):
+    """Gaussian blobs, so plenty of rows sit near a cluster boundary."""
+    rng = np.random.default_rng(seed)
+    means = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    labels = rng.integers(num_clusters, size=num_rows)
+    return means[labels] + 2 * rng.standard_normal((num_rows, dim)).astype(np.float32)
+
+def check_centroid_assignment(km_model, embeddings, n_threads=None):
+    X = np.asarray(embeddings, dtype=km_model.cluster_centers_.dtype)
+    begin = time.perf_counter()
+    expected = km_model.predict(X)
+    sklearn_seconds = time.perf_counter() - begin
+
+    assigner = CentroidAssigner.from_model(km_model, n_threads=n_threads)
+    begin = time.perf_counter()
+    actual = assigner.predict(embeddings)
+    assigner_seconds = time.perf_counter() - begin
+
+    num_diff = int((expected != actual).sum())
+    print(f"{len(actual)} rows, {assigner.num_ambiguous} near ties re-resolved, {num_diff} labels differ")
+    print(f"sklearn predict: {sklearn_seconds:.2f} s, CentroidAssigner: {assigner_seconds:.2f} s")
+    if num_diff:
+        raise AssertionError(f"{num_diff} labels differ from km_model.predict")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check CentroidAssigner labels against sklearn predict')
+    parser.add_argument('--km-model', default=None, type=str,
+                help='fitted joblib k-means model (default: fit one on synthetic data)')
+    parser.add_argument('--embeddings', default=None, type=str,
+                help='embedding store or parquet to assign (default: synthetic data)')
+    parser.add_argument('--num-rows', default=200_000, type=int)
+    parser.add_argument('--dim', default=1024, type=int)
+    parser.add_argument('--num-clusters', default=500, type=int)
+    parser.add_argument('--n-threads', default=None, type=int)
+    args = parser.parse_args()
+
+    if args.embeddings is not None:
+        _, embeddings = load_embeddings(args.embeddings, dim=args.dim)
+    else:
+        embeddings = synthetic_embeddings(args.num_rows, args.dim, args.num_clusters)
+
+    if args.km_model is not None:
+        km_model = joblib.load(args.km_model)
+    else:
+        km_model = MiniBatchKMeans(n_clusters=args.num_clusters, batch_size=10_000, compute_labels=False, n_init=3)
+        km_model.partial_fit(np.asarray(embeddings[:50_000], dtype=np.float32))
+
+    check_centroid_assignment(km_model, embeddings, args.n_threads)
@@ -0,0 +1,77 @@
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from length_debias import LengthDebiaser, load_or_fit_debiaser
+
+# Expected ATDS sort_by_atds_token.py divided by before the models were fit
+OLD_TOKEN_QUADRATIC = [-0.0000007272, 0.00109283, 0.23890562]
+
+def synthetic_scores(rng, num_groups, noise=0.05):
+    """Score table whose ATDS is the old expected ATDS of its length times lognormal noise."""
+    piece_counts_sum = rng.integers(50, 700, size=num_groups)
+    num_frames = rng.integers(100, 2000, size=num_groups)
+    factor = np.exp(rng.normal(0, noise, size=num_groups))
+    scores_df = pd.DataFrame({"atds": np.polyval(OLD_TOKEN_QUADRATIC, piece_counts_sum) * factor,
+                              "piece_counts_sum": piece_counts_sum, "num_frames": num_frames},
+                             index=pd.Index([str(i) for i in range(num_groups)], name="group_id"))
+    # a group without pieces is never fit on nor debiased
+    scores_df.iloc[0, scores_df.columns.get_loc("piece_counts_sum")] = 0
+    return scores_df, factor
+
+def model_identity(path):
+    # save() replaces the file, so a refit shows up as a new inode
+    return os.stat(path).st_ino
+
+def check_length_debias(num_groups, seed=0):
+    rng = np.random.default_rng(seed)
+    scores_df, factor = synthetic_scores(rng, num_groups)
+
+    debiaser = LengthDebiaser.fit(scores_df, "piece_counts_sum", "polynomial", degree=2)
+    coef_err = np.abs(debiaser.model.coef - OLD_TOKEN_QUADRATIC) / np.abs(OLD_TOKEN_QUADRATIC)
+    debiased = debiaser.debias(scores_df)
+    print(f"{debiaser}; coefficient relative error {coef_err.max():.3g}")
+    if coef_err.max() > 0.2 or not np.isnan(debiased.iloc[0]):
+        raise AssertionError("polynomial fit does not recover the quadratic, or debiased a group without pieces")
+    if np.corrcoef(debiased.iloc[1:], factor[1:])[0, 1] < 0.95:
+        raise AssertionError("debiased ATDS does not follow the noise around the expected ATDS")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for kind, feature, kwargs in (("polynomial", "piece_counts_sum", {"degree": 2}),
+                                      ("linear", "num_frames", {}), ("isotonic", "piece_counts_sum", {})):
+            path = os.path.join(work_dir, f"{kind}.npz")
+            fitted = LengthDebiaser.fit(scores_df, feature, kind, **kwargs)
+            fitted.save(path)
+            loaded = LengthDebiaser.load(path)
+            if loaded.meta != fitted.meta or not np.array_equal(loaded.debias(scores_df), fitted.debias(scores_df), equal_nan=True):
+                raise AssertionError(f"{kind} model changed in a save/load round trip")
+        print("save/load round trip of polynomial, linear and isotonic models is exact")
+
+        path = os.path.join(work_dir, "load_or_fit.npz")
+        load_or_fit_debiaser(path, scores_df, "piece_counts_sum", "polynomial", degree=2)
+        fitted_at = model_identity(path)
+        load_or_fit_debiaser(path, scores_df, "piece_counts_sum", "polynomial", degree=2)
+        if model_identity(path) != fitted_at:
+            raise AssertionError("load_or_fit_debiaser refit on unchanged scores")
+
+        changed_df = scores_df.copy()
+        changed_df.iloc[1, changed_df.columns.get_loc("atds")] *= 1.5
+        for what, args, kwargs in (("scores", (changed_df, "piece_counts_sum", "polynomial"), {"degree": 2}),
+                                   ("degree", (changed_df, "piece_counts_sum", "polynomial"), {"degree": 3}),
+                                   ("feature", (changed_df, "num_frames", "polynomial"), {"degree": 3}),
+                                   ("kind", (changed_df, "num_frames", "linear"), {})):
+            debiaser = load_or_fit_debiaser(path, *args, **kwargs)
+            if model_identity(path) == fitted_at or debiaser.feature != args[1] or debiaser.meta["kind"] != args[2]:
+                raise AssertionError(f"load_or_fit_debiaser did not refit after the {what} changed")
+            fitted_at = model_identity(path)
+        print("load_or_fit_debiaser reuses the model on the same scores and refits after scores, degree, feature or kind change")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check fitting, saving, loading and applying length-debiasing models')
+    parser.add_argument('--num-groups', default=5000, type=int)
+    args = parser.parse_args()
+
+    check_length_debias(args.num_groups)
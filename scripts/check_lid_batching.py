@@ -0,0 +1,63 @@
+import argparse
+
+import numpy as np
+import torch
+
+from group_table import load_group_table, grouped_paths, group_frames
+from lid_engine import FBANK_HOP_SAMPLES, lid_log_probs, load_group_signal
+from lid_posteriors import LID_SOURCE, load_language_id
+
+def check_lid_batching(groups_path, base_dir, num_groups, max_batch_frames, bucket_size=FBANK_HOP_SAMPLES,
+                       source=LID_SOURCE, atol=1e-3):
+    """
+    Compare padded multi-group classification against classifying each
+    group's concatenated signal on its own, on CPU.
+
+    Returns:
+    tuple: (max absolute difference of the log-posteriors, top-1 agreement,
+            number of groups where any language's rank changed) over all groups
+    """
+    language_id = load_language_id("cpu", source=source)
+    group_table = load_group_table(groups_path)
+    groups = dict(list(grouped_paths(group_table).items())[:num_groups])
+    num_frames = group_frames(group_table).loc[list(groups)].to_numpy()
+
+    batched = lid_log_probs(language_id, groups, base_dir, num_frames, max_batch_frames=max_batch_frames,
+                            bucket_size=bucket_size)
+
+    max_diff = 0.0
+    num_scored = num_agree = num_rank_changed = 0
+    for row, (group_id, filenames) in zip(batched, groups.items()):
+        signal = load_group_signal(language_id, base_dir, filenames)
+        if signal is None:
+            continue
+        with torch.no_grad():
+            single = language_id.classify_batch(signal)[0].reshape(-1).numpy()
+        diff = float(np.abs(single - row).max())
+        max_diff = max(max_diff, diff)
+        num_scored += 1
+        num_agree += int(single.argmax() == row.argmax())
+        # rank of every language as SB_rank.py counts it: 1 + languages scored above it
+        rank_changes = int(((single[None, :] > single[:, None]).sum(axis=1) != (row[None, :] > row[:, None]).sum(axis=1)).sum())
+        num_rank_changed += int(rank_changes > 0)
+        print(f"group {group_id}: {signal.shape[-1] / 16000:.1f} sec, argmax {single.argmax()} / {row.argmax()}, "
+              f"max abs diff {diff:.2e}, {rank_changes} languages changed rank")
+
+    top1_agreement = num_agree / num_scored if num_scored else float("nan")
+    print(f"Max abs diff over {num_scored} groups: {max_diff:.2e}, top-1 agreement {top1_agreement:.3f}, "
+          f"{num_rank_changed} groups with rank changes ({'OK' if max_diff <= atol and num_rank_changed == 0 else 'NG'})")
+    return max_diff, top1_agreement, num_rank_changed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check that batched language-ID scoring matches per-group scoring on CPU')
+    parser.add_argument('--groups', required=True, type=str, help='group table')
+    parser.add_argument('--base-dir', required=True, type=str)
+    parser.add_argument('--num-groups', default=16, type=int)
+    parser.add_argument('--max-batch-frames', default=16_000 * 120, type=int)
+    parser.add_argument('--bucket-size', default=FBANK_HOP_SAMPLES, type=int,
+                help='samples; only groups with the same length // bucket-size share a batch, 0 pads any lengths together')
+    parser.add_argument('--source', default=LID_SOURCE, type=str, help=f'classifier to load (default: {LID_SOURCE})')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    check_lid_batching(args.groups, args.base_dir, args.num_groups, args.max_batch_frames, args.bucket_size or None, args.source)
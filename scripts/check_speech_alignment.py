@@ -0,0 +1,58 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from embedding_engine import align_speech_codes
+
+def cross_merge_speech_codes(speech_timestamps, sample_rate, num_samples, embeddings):
+    """The original getembeddings alignment, kept as the reference."""
+    embedding_cols = [f"e{i:03}" for i in range(embeddings.shape[1])]
+    speech_intervals = pd.DataFrame(speech_timestamps)
+    embeddings_df = pd.DataFrame(embeddings, columns=embedding_cols)
+    wav_dur_in_seconds = num_samples/sample_rate
+
+    start_times = np.linspace(0.00, wav_dur_in_seconds, embeddings.shape[0], endpoint=False)
+    end_times = np.concatenate([start_times[1:], np.array([wav_dur_in_seconds])])
+    embeddings_df["code_start_time"] = start_times
+    embeddings_df["code_end_time"] = end_times
+
+    speech_intervals.start /= sample_rate
+    speech_intervals.end /= sample_rate
+
+    speech_codes = speech_intervals.merge(embeddings_df, how="cross").query("code_start_time >= start and code_end_time <= end")
+    return speech_codes.code_start_time.to_numpy(), speech_codes.code_end_time.to_numpy(), speech_codes[embedding_cols].to_numpy()
+
+def random_speech_timestamps(rng, num_samples, max_intervals):
+    """Sorted, non-overlapping intervals in samples, like silero's get_speech_timestamps."""
+    num_intervals = rng.integers(1, max_intervals + 1)
+    bounds = np.sort(rng.choice(num_samples, size=2 * num_intervals, replace=False))
+    return [{'start': int(s), 'end': int(e)} for s, e in bounds.reshape(-1, 2)]
+
+def check_speech_alignment(num_trials, sample_rate=16_000, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    for trial in range(num_trials):
+        num_samples = int(rng.integers(400, sample_rate * 20))
+        num_codes = num_samples // 320
+        embeddings = rng.standard_normal((num_codes, dim)).astype(np.float32)
+        speech_timestamps = random_speech_timestamps(rng, num_samples, max_intervals=8)
+
+        # Snap some boundaries onto code boundaries to exercise the >= / <= edges
+        if trial % 2 == 0:
+            for t in speech_timestamps:
+                t['start'] = t['start'] // 320 * 320
+
+        expected = cross_merge_speech_codes(speech_timestamps, sample_rate, num_samples, embeddings)
+        actual = align_speech_codes(speech_timestamps, sample_rate, num_samples, embeddings)
+        for name, e, a in zip(["start_times", "end_times", "embeddings"], expected, actual):
+            if e.shape != a.shape or not np.array_equal(e, a):
+                raise AssertionError(f"trial {trial}: {name} differs ({e.shape} vs {a.shape})")
+
+    print(f"{num_trials} trials: vectorized alignment matches the cross merge")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check vectorized VAD alignment against the pandas cross merge')
+    parser.add_argument('--num-trials', default=500, type=int)
+    args = parser.parse_args()
+
+    check_speech_alignment(args.num_trials)
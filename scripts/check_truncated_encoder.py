@@ -0,0 +1,55 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import torchaudio
+
+from embedding_engine import forward_single, get_model, truncate_encoder
+
+def check_truncated_encoder(checkpoint_path, wav_dir, num_files, num_layers=12, device='cpu', atol=1e-4):
+    """
+    Check that the layer-N output of the truncated encoder matches the full
+    model's layer_results[N-1], and time both.
+
+    Returns:
+    tuple: (max absolute difference, full model seconds, truncated model seconds)
+    """
+    full_model = get_model(checkpoint_path, device)
+    # a second load rather than copy.deepcopy, which fails on the weight-normed positional conv
+    truncated_model = truncate_encoder(get_model(checkpoint_path, device), num_layers)
+
+    wav_files = sorted(Path(wav_dir).glob("*.wav"))[:num_files]
+    wavs = [torchaudio.load(p)[0] for p in wav_files]
+
+    max_diff = 0.0
+    full_seconds = 0.0
+    truncated_seconds = 0.0
+    for wav_file, wav in zip(wav_files, wavs):
+        begin = time.perf_counter()
+        full = forward_single(full_model, wav, layers=(num_layers,), device=device)
+        full_seconds += time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        truncated = forward_single(truncated_model, wav, layers=(num_layers,), device=device)
+        truncated_seconds += time.perf_counter() - begin
+
+        diff = float(np.abs(full - truncated).max())
+        max_diff = max(max_diff, diff)
+        print(f"{wav_file.name}: {full.shape[0]} codes, max abs diff {diff:.2e}")
+
+    print(f"Max abs diff over {len(wavs)} files: {max_diff:.2e} ({'OK' if max_diff <= atol else 'NG'})")
+    print(f"Full model: {full_seconds:.2f} s, first {num_layers} layers: {truncated_seconds:.2f} s "
+          f"({full_seconds / truncated_seconds:.2f}x)")
+    return max_diff, full_seconds, truncated_seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the truncated encoder against the full wav2vec2 model')
+    parser.add_argument('--checkpoint-path', required=True, type=str)
+    parser.add_argument('--wav-dir', required=True, type=str)
+    parser.add_argument('--num-files', default=16, type=int)
+    parser.add_argument('--num-layers', default=12, type=int)
+    parser.add_argument('--device', default='cpu', type=str)
+    args = parser.parse_args()
+
+    check_truncated_encoder(args.checkpoint_path, args.wav_dir, args.num_files, args.num_layers, args.device)
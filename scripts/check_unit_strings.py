@@ -0,0 +1,67 @@
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from unit_strings import utterance_offsets, unit_strings, collapse_runs
+
+def regex_utts_df(all_clusters_df):
+    """The original make_all_clusters_df + make_all_utts_df unit strings, kept as the reference."""
+    def merge_duplicates(line):
+        return re.sub(r"(.)\1+", r"\1", line, 0, re.MULTILINE)
+
+    all_clusters_df = all_clusters_df.copy()
+    all_clusters_df["cluster_char"] = [chr(i + 34) for i in all_clusters_df.cluster_id]
+    all_utts_df = all_clusters_df.groupby(["lang", "wav_file"])["cluster_char"].apply(''.join).reset_index()
+    all_utts_df.cluster_char = all_utts_df.cluster_char.apply(merge_duplicates)
+    return all_utts_df
+
+def random_clusters_df(rng, num_utts, num_clusters=500):
+    """Clusters with runs of repeated units; utterances split over several non-adjacent chunks of rows."""
+    utt_lengths = rng.integers(0, 600, size=num_utts)
+    utt_ids = np.repeat(np.arange(num_utts), utt_lengths)
+    run_lengths = rng.integers(1, 5, size=len(utt_ids))
+    cluster_ids = np.repeat(rng.integers(num_clusters, size=len(utt_ids)), run_lengths)[:len(utt_ids)]
+    clusters_df = pd.DataFrame({
+        "wav_file": [f"utt{i:06}.wav" for i in utt_ids],
+        "cluster_id": cluster_ids.astype(np.int32),
+        "lang": np.where(utt_ids % 3 == 0, "punjabi", "urdu"),
+    })
+    # Interleave two halves so groupby has to gather rows of the same utterance
+    half = len(clusters_df) // 2
+    return pd.concat([clusters_df.iloc[half:], clusters_df.iloc[:half]], ignore_index=True)
+
+def check_unit_strings(num_utts, seed=0):
+    rng = np.random.default_rng(seed)
+    clusters_df = random_clusters_df(rng, num_utts)
+
+    begin = time.perf_counter()
+    expected = regex_utts_df(clusters_df)
+    regex_seconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    actual, cluster_ids, offsets = utterance_offsets(clusters_df)
+    actual["cluster_char"] = unit_strings(cluster_ids, offsets)
+    vectorized_seconds = time.perf_counter() - begin
+
+    if not expected.equals(actual):
+        raise AssertionError("vectorized unit strings differ from the regex reference")
+
+    # The integer output is the same sequence without the character mapping
+    collapsed_ids, collapsed_offsets = collapse_runs(cluster_ids, offsets)
+    for i in rng.choice(len(actual), size=min(50, len(actual)), replace=False):
+        units = [ord(c) - 34 for c in actual.cluster_char[i]]
+        if units != collapsed_ids[collapsed_offsets[i]:collapsed_offsets[i + 1]].tolist():
+            raise AssertionError(f"collapsed ids of utterance {i} differ")
+
+    print(f"{len(actual)} utterances, {len(clusters_df)} frames: identical unit strings")
+    print(f"regex: {regex_seconds:.2f} s, vectorized: {vectorized_seconds:.2f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check vectorized unit strings against make_all_clusters_df + make_all_utts_df')
+    parser.add_argument('--num-utts', default=5000, type=int)
+    args = parser.parse_args()
+
+    check_unit_strings(args.num_utts)
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from atds_scoring import atds_scores
+from utterance_selection import GreedySelector, greedy_select
+
+class SyntheticPool:
+    """Stand-in for corpus_atds.UtteranceHistograms: utterances and their piece histograms."""
+
+    def __init__(self, histograms, num_frames):
+        self.histograms = histograms
+        self.utterances = pd.DataFrame({"wav_file": [f"utt{i:05}.wav" for i in range(len(num_frames))],
+                                        "num_frames": num_frames})
+
+def synthetic_pool(rng, num_utterances, vocab_size, max_pieces=400):
+    rows, cols = [], []
+    for i, n in enumerate(rng.integers(0, max_pieces, size=num_utterances)):
+        rows.append(np.full(n, i))
+        cols.append(np.minimum(rng.zipf(1.3, size=n) - 1, vocab_size - 1))
+    histograms = sparse.csr_matrix((np.ones(sum(len(r) for r in rows)), (np.concatenate(rows), np.concatenate(cols))),
+                                   shape=(num_utterances, vocab_size))
+    histograms.sum_duplicates()
+    num_frames = rng.integers(16_000 * 2, 16_000 * 20, size=num_utterances)
+    return SyntheticPool(histograms, num_frames)
+
+def check_utterance_selection(num_utterances, vocab_size, num_steps, seed=0, atol=1e-12):
+    """
+    Step GreedySelector and, at every step, rescore the selection plus each
+    candidate from scratch with atds_scores. Then check that greedy_select's
+    reported ATDS after each step is the ATDS of its selection so far.
+
+    Returns:
+    float: max absolute difference of the marginal gains over all steps
+    """
+    rng = np.random.default_rng(seed)
+    pool = synthetic_pool(rng, num_utterances, vocab_size)
+    ref_histogram = np.bincount(np.minimum(rng.zipf(1.3, size=200_000) - 1, vocab_size - 1), minlength=vocab_size)
+    dense = pool.histograms.toarray()
+
+    selector = GreedySelector(pool.histograms, ref_histogram)
+    scorable = selector.sq_norms > 0
+    selection = np.zeros(vocab_size)
+    max_diff = 0.0
+    begin = time.perf_counter()
+    for step in range(num_steps):
+        current = atds_scores(selection[None, :], ref_histogram)[0] if selection.any() else np.nan
+        if not np.isnan(current):
+            max_diff = max(max_diff, abs(selector.atds() - current))
+
+        expected = atds_scores(dense + selection, ref_histogram) - (0.0 if np.isnan(current) else current)
+        actual = selector.marginal_gains()
+        max_diff = max(max_diff, float(np.abs(expected - actual)[scorable].max()))
+
+        idx = int(np.argmax(np.where(scorable, actual, -np.inf)))
+        selector.add(idx)
+        selection += dense[idx]
+    print(f"{num_steps} steps over {num_utterances} utterances: max |incremental - from scratch| {max_diff:.3g} "
+          f"({time.perf_counter() - begin:.2f} s)")
+
+    selection_df = greedy_select(pool, ref_histogram, num_hours=num_steps * 11 / 60 / 60)
+    positions = pool.utterances.reset_index().set_index("wav_file").loc[selection_df.wav_file, "index"].to_numpy()
+    prefix_atds = atds_scores(sparse.csr_matrix(np.cumsum(dense[positions], axis=0)), ref_histogram)
+    greedy_diff = float(np.abs(prefix_atds - selection_df.atds.to_numpy()).max())
+    print(f"greedy_select picked {len(selection_df)} files, max |reported - recomputed ATDS| {greedy_diff:.3g}")
+
+    if max_diff > atol or greedy_diff > atol:
+        raise AssertionError("incremental ATDS differs from rescoring the selection")
+    return max_diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check GreedySelector against rescoring every candidate selection with atds_scores')
+    parser.add_argument('--num-utterances', default=500, type=int)
+    parser.add_argument('--vocab-size', default=2000, type=int)
+    parser.add_argument('--num-steps', default=50, type=int)
+    args = parser.parse_args()
+
+    check_utterance_selection(args.num_utterances, args.vocab_size, args.num_steps)
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from corpus_atds import pool_df
+
+def random_subset_jobs(pool, num_hours, num_jobs, output_pattern, seed):
+    """
+    num_jobs random subsets of the pool, each picked like get_data_df picks
+    one: shuffle, then keep the prefix of at most num_hours. Job i is
+    shuffled with random_state seed + i and written to output_pattern.format(i).
+
+    Returns:
+    list of dict: wav_files, num_frames and output of each job
+    """
+    frames_per_job = int(16_000 * 60 * 60 * num_hours)
+    jobs = []
+    for i in range(num_jobs):
+        subset_df = pool.sample(frac=1.0, random_state=seed + i)
+        subset_df = subset_df[subset_df.num_frames.cumsum() <= frames_per_job]
+        jobs.append({"wav_files": subset_df.path.to_list(), "num_frames": subset_df.num_frames.to_list(),
+                     "output": output_pattern.format(i)})
+    return jobs
+
+def read_jobs(jobs_file):
+    """Jobs from a JSON lines file, one {"wav_files": [...], "output": ...} object per line ("num_frames" optional)."""
+    with open(jobs_file, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class ClusterJobRunner:
+    """
+    Long-lived extract -> k-means worker. The wav2vec2 model, VAD, codebook
+    and embedding cache are loaded once, then every job only runs its own
+    files through them and writes a clustered parquet (wav_file, cluster_id
+    per speech code), the output infer_k-means.py writes.
+    """
+
+    def __init__(self, checkpoint_path, km_model, wav_dir, layer=12, device='cuda', cache_dir=None, cache_max_gb=200):
+        import joblib
+        import torch
+
+        from atds_pipeline import ATDSPipeline
+        from embedding_cache import EmbeddingCache
+        from embedding_engine import get_model, truncate_encoder
+
+        start = time.perf_counter()
+        print(f'Getting model from {checkpoint_path}')
+        model = truncate_encoder(get_model(checkpoint_path, device), layer)
+        print('Loading VAD')
+        vad_model, vad_utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False, onnx=False)
+        embedding_cache = None
+        if cache_dir is not None:
+            embedding_cache = EmbeddingCache(cache_dir, checkpoint_path, max_bytes=int(cache_max_gb * 2**30))
+
+        # Only the extract and cluster stages are used, so no tokenizer or reference
+        self.pipeline = ATDSPipeline(model, vad_model, vad_utils[0], joblib.load(km_model), None, None,
+                                     embedding_cache=embedding_cache, layer=layer, device=device)
+        self.wav_dir = wav_dir
+        self.load_seconds = time.perf_counter() - start
+        print(f'Models loaded in {self.load_seconds:.1f}s')
+
+    def run_job(self, wav_files, output_path, num_frames=None):
+        """
+        Returns:
+        int: number of clustered speech codes written
+        """
+        utt_cluster_ids = self.pipeline.cluster_utterances(wav_files, self.wav_dir, num_frames)
+        clustered_df = pd.DataFrame({
+            "wav_file": np.repeat(list(utt_cluster_ids), [len(ids) for ids in utt_cluster_ids.values()]),
+            "cluster_id": np.concatenate(list(utt_cluster_ids.values())) if utt_cluster_ids else np.empty(0, dtype=np.int32),
+        })
+        tmp_path = output_path + ".tmp"
+        clustered_df.to_parquet(tmp_path)
+        os.replace(tmp_path, output_path)
+        return len(clustered_df)
+
+    def run(self, jobs):
+        """
+        Run the jobs in order, skipping those whose output already exists,
+        and report the latency of each.
+
+        Returns:
+        pd.DataFrame: output, num_files, num_codes and seconds of each job run
+        """
+        latencies = []
+        for job_idx, job in enumerate(jobs):
+            if os.path.exists(job["output"]):
+                print(f'Job {job_idx + 1}/{len(jobs)}: {job["output"]} exists, skipping')
+                continue
+
+            start = time.perf_counter()
+            num_codes = self.run_job(job["wav_files"], job["output"], job.get("num_frames"))
+            seconds = time.perf_counter() - start
+            latencies.append({"output": job["output"], "num_files": len(job["wav_files"]), "num_codes": num_codes, "seconds": seconds})
+            print(f'Job {job_idx + 1}/{len(jobs)}: {len(job["wav_files"])} files, {num_codes} codes '
+                  f'-> {job["output"]} in {seconds:.2f}s')
+
+        latency_df = pd.DataFrame(latencies, columns=["output", "num_files", "num_codes", "seconds"])
+        if len(latency_df):
+            print(f'{len(latency_df)} jobs, latency mean {latency_df.seconds.mean():.2f}s, '
+                  f'median {latency_df.seconds.median():.2f}s, max {latency_df.seconds.max():.2f}s; '
+                  f'loading the models once instead of per job saved ~{self.load_seconds * (len(latency_df) - 1):.0f}s')
+        return latency_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract and cluster many subsets with models loaded once')
+    parser.add_argument('--checkpoint-path', required=True, type=str)
+    parser.add_argument('--km-model', required=True, type=str)
+    parser.add_argument('--wav-dir', required=True, type=str)
+    parser.add_argument('--jobs-file', default=None, type=str,
+                help='optional. JSON lines jobs; otherwise --num-jobs random --num-hours subsets of --wav-dir')
+    parser.add_argument('--manifest-path', default=None, type=str,
+                help='optional. Take the pool for random subsets from a tsv manifest instead of the directory listing')
+    parser.add_argument('--num-hours', default=0.5, type=float)
+    parser.add_argument('--num-jobs', default=1000, type=int)
+    parser.add_argument('--seed', default=int(time.time()), type=int,
+                help='random_state of the first subset, the next ones use seed+1, seed+2, ... (default: current time)')
+    parser.add_argument('--output-pattern', default='tmp/clustered{}_.parquet', type=str,
+                help='output of random subset i, formatted with i')
+    parser.add_argument('--layer', default=12, type=int)
+    parser.add_argument('--device', default='cuda', type=str)
+    parser.add_argument('--cache-dir', default=None, type=str)
+    parser.add_argument('--latency-csv', default=None, type=str, help='optional. Write the per-job latencies here')
+    args = parser.parse_args()
+
+    if args.jobs_file is not None:
+        jobs = read_jobs(args.jobs_file)
+    else:
+        print(f'Random subsets with seeds {args.seed}..{args.seed + args.num_jobs - 1}')
+        jobs = random_subset_jobs(pool_df(args.wav_dir, args.manifest_path), args.num_hours, args.num_jobs,
+                                  args.output_pattern, args.seed)
+
+    runner = ClusterJobRunner(args.checkpoint_path, args.km_model, args.wav_dir, layer=args.layer,
+                              device=args.device, cache_dir=args.cache_dir)
+    latency_df = runner.run(jobs)
+    if args.latency_csv is not None:
+        latency_df.to_csv(args.latency_csv, index=False)
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from tqdm import tqdm
+
+from atds_scoring import piece_histograms, atds_scores
+from embedding_cache import file_sha256
+
+CORPUS_VERSION = 1
+# Files clustered and tokenized per pipeline call while building
+CHUNK_FILES = 2_000
+
+def pool_df(wav_dir, manifest_path=None):
+    """
+    Donor pool in get_multiple_data_df's order before shuffling: the manifest
+    order, or the sorted *.wav listing of wav_dir.
+    """
+    if manifest_path is not None:
+        return pd.read_csv(manifest_path, sep="\t", skiprows=1, header=None, names=["path", "num_frames"])
+
+    import torchaudio
+    paths = sorted(Path(wav_dir).glob("*.wav"))
+    return pd.DataFrame({"path": [p.name for p in paths], "num_frames": [torchaudio.info(p).num_frames for p in paths]})
+
+def pool_groups(num_frames, num_hours, num_sets):
+    """
+    Split a pool into consecutive groups of at most num_hours each, the way
+    get_multiple_data_df does: every group takes the longest prefix of the
+    remaining files that fits, and splitting stops at the first empty group.
+
+    Returns:
+    list of np.ndarray: positions in the pool of each group's files
+    """
+    bounds = np.concatenate([[0], np.cumsum(num_frames)])
+    frames_per_set = int(16_000 * 60 * 60 * num_hours)
+
+    groups = []
+    start = 0
+    for _ in range(num_sets):
+        end = np.searchsorted(bounds, bounds[start] + frames_per_set, side="right") - 1
+        if end <= start:
+            break
+        groups.append(np.arange(start, end))
+        start = end
+    return groups
+
+def build_utterance_histograms(pipeline, wav_files, wav_dir, output_dir, num_frames=None, chunk_files=CHUNK_FILES, **meta):
+    """
+    Embed, cluster and tokenize every file of the pool once and save one
+    piece histogram per utterance. Files without speech get an empty row.
+    Extra keyword arguments are stored in meta.json.
+    """
+    vocab_size = pipeline.sp.get_piece_size()
+    chunks = []
+
+    for start in tqdm(range(0, len(wav_files), chunk_files)):
+        chunk = list(wav_files[start:start + chunk_files])
+        chunk_frames = None if num_frames is None else list(num_frames[start:start + chunk_files])
+        utt_cluster_ids = pipeline.cluster_utterances(chunk, wav_dir, chunk_frames)
+        piece_ids, offsets = pipeline.encode_utterances(utt_cluster_ids)
+
+        # Rows come out in utt_cluster_ids order and without the files that had no speech
+        speech_histograms = piece_histograms(piece_ids, offsets, vocab_size)
+        rows = pd.Index(chunk).get_indexer(list(utt_cluster_ids))
+        chunks.append(sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, np.arange(len(rows)))),
+                                        shape=(len(chunk), len(rows))) @ speech_histograms)
+
+    histograms = sparse.vstack(chunks, format="csr") if chunks else sparse.csr_matrix((0, vocab_size), dtype=np.int64)
+    os.makedirs(output_dir, exist_ok=True)
+    sparse.save_npz(os.path.join(output_dir, "histograms.npz"), histograms)
+    pd.DataFrame({
+        "wav_file": list(wav_files),
+        "num_frames": np.zeros(len(wav_files), dtype=np.int64) if num_frames is None else np.asarray(num_frames),
+    }).to_parquet(os.path.join(output_dir, "utterances.parquet"))
+    with open(os.path.join(output_dir, "meta.json"), "w") as f:
+        json.dump({"version": CORPUS_VERSION, "vocab_size": vocab_size, "wav_dir": wav_dir, **meta}, f, indent=2)
+
+    return UtteranceHistograms(output_dir)
+
+class UtteranceHistograms:
+    """
+    Per-utterance piece histograms of a whole donor pool.
+
+    Piece counts add up over utterances, so the histogram of any group of
+    files is the sum of its rows, and scoring a new grouping is one sparse
+    matrix product instead of re-extracting the audio.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != CORPUS_VERSION:
+            raise ValueError(f"{path} is utterance histogram version {self.meta['version']}, expected {CORPUS_VERSION}")
+
+        self.histograms = sparse.load_npz(os.path.join(path, "histograms.npz")).tocsr()
+        self.utterances = pd.read_parquet(os.path.join(path, "utterances.parquet"))
+        self._index = pd.Index(self.utterances.wav_file)
+
+    def indices(self, wav_files):
+        idx = self._index.get_indexer(wav_files)
+        if (idx < 0).any():
+            missing = [wav_files[i] for i in np.flatnonzero(idx < 0)[:5]]
+            raise KeyError(f"{int((idx < 0).sum())} files are not in the pool, e.g. {missing}")
+        return idx
+
+    def group_histograms(self, group_indices):
+        """
+        Parameters:
+        group_indices (list of np.ndarray): utterance positions of each group
+
+        Returns:
+        scipy.sparse.csr_matrix: (num_groups, vocab_size) summed piece counts
+        """
+        sizes = [len(idx) for idx in group_indices]
+        rows = np.repeat(np.arange(len(group_indices)), sizes)
+        cols = np.concatenate(group_indices) if group_indices else np.empty(0, dtype=np.int64)
+        membership = sparse.csr_matrix((np.ones(len(cols), dtype=np.int64), (rows, cols)),
+                                       shape=(len(group_indices), self.histograms.shape[0]))
+        return membership @ self.histograms
+
+    def score(self, group_indices, ref_histogram):
+        """
+        Returns:
+        pd.DataFrame: atds and piece_counts_sum of each group
+        """
+        histograms = self.group_histograms(group_indices)
+        return pd.DataFrame({
+            "atds": atds_scores(histograms, ref_histogram),
+            "piece_counts_sum": np.asarray(histograms.sum(axis=1)).ravel(),
+        })
+
+    def score_groups(self, groups, ref_histogram):
+        """Score groups given as lists of wav files (e.g. group_table.grouped_paths)."""
+        return self.score([self.indices(list(wav_files)) for wav_files in groups], ref_histogram)
+
+    def score_pool_groups(self, num_hours, num_sets, ref_histogram, random_state=None):
+        """
+        Score the groups get_multiple_data_df would make from this pool. With
+        random_state the pool is shuffled first like get_multiple_data_df does
+        for a directory listing (pass its RANDOM_STATE to get the same sets).
+        """
+        order = np.arange(len(self.utterances))
+        if random_state is not None:
+            order = self.utterances.sample(frac=1.0, random_state=random_state).index.to_numpy()
+        groups = pool_groups(self.utterances.num_frames.to_numpy()[order], num_hours, num_sets)
+        return self.score([order[g] for g in groups], ref_histogram)
+
+def build(args):
+    import joblib
+    import sentencepiece as spm
+    import torch
+
+    from atds_pipeline import ATDSPipeline
+    from embedding_cache import EmbeddingCache
+    from embedding_engine import get_model, truncate_encoder
+
+    pool = pool_df(args.wav_dir, args.manifest_path)
+    print(f"Pool: {len(pool)} files, {pool.num_frames.sum() / 16000 / 60 / 60:.2f} hours")
+
+    model = truncate_encoder(get_model(args.checkpoint_path), args.layer)
+    vad_model, vad_utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False, onnx=False)
+    get_speech_timestamps = vad_utils[0]
+    embedding_cache = None
+    if args.cache_dir is not None:
+        embedding_cache = EmbeddingCache(args.cache_dir, args.checkpoint_path)
+
+    sp = spm.SentencePieceProcessor(model_file=args.spm_model)
+    pipeline = ATDSPipeline(model, vad_model, get_speech_timestamps, joblib.load(args.km_model), sp, None,
+                            embedding_cache=embedding_cache, layer=args.layer)
+    build_utterance_histograms(pipeline, pool.path.to_list(), args.wav_dir, args.output_dir,
+                               num_frames=pool.num_frames.to_list(),
+                               spm_sha256=file_sha256(args.spm_model), kmeans_sha256=file_sha256(args.km_model))
+    print(f"Saved per-utterance histograms to {args.output_dir}")
+
+def score(args):
+    from reference_histogram import ReferenceHistogram
+
+    corpus = UtteranceHistograms(args.histograms)
+    reference = ReferenceHistogram(args.reference)
+    for key in ["spm_sha256", "kmeans_sha256"]:
+        if corpus.meta.get(key) != reference.meta[key]:
+            raise ValueError(f"{args.histograms} and {args.reference} were built with different models ({key})")
+
+    if args.groups is not None:
+        from group_table import load_group_table, grouped_paths
+        groups = grouped_paths(load_group_table(args.groups))
+        scores_df = corpus.score_groups(groups.values(), reference.histogram)
+        scores_df.index = list(groups.keys())
+    else:
+        scores_df = corpus.score_pool_groups(args.num_hours, args.num_sets, reference.histogram, args.random_state)
+
+    scores_df.atds = scores_df.atds.round(4)
+    scores_df.to_csv(args.output_csv)
+    print(f"Scored {len(scores_df)} groups, saved to {args.output_csv}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Whole-corpus ATDS: tokenize the donor pool once, then score any grouping')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='embed, cluster and tokenize the pool into per-utterance histograms')
+    build_parser.add_argument('--checkpoint-path', required=True, type=str)
+    build_parser.add_argument('--wav-dir', required=True, type=str)
+    build_parser.add_argument('--manifest-path', default=None, type=str,
+                help='optional. Take the pool from a tsv manifest instead of the directory listing')
+    build_parser.add_argument('--km-model', required=True, type=str)
+    build_parser.add_argument('--spm-model', required=True, type=str)
+    build_parser.add_argument('--output-dir', required=True, type=str)
+    build_parser.add_argument('--layer', default=12, type=int)
+    build_parser.add_argument('--cache-dir', default=None, type=str)
+
+    score_parser = subparsers.add_parser('score', help='score groups of the pool against a reference histogram')
+    score_parser.add_argument('--histograms', required=True, type=str, help='output dir of the build command')
+    score_parser.add_argument('--reference', required=True, type=str, help='reference histogram .npz')
+    score_parser.add_argument('--groups', default=None, type=str,
+                help='group table as written by run_get_multiple_data_df.py; otherwise split the pool by --num-hours/--num-sets')
+    score_parser.add_argument('--num-hours', default=0.006, type=float)
+    score_parser.add_argument('--num-sets', default=14000, type=int)
+    score_parser.add_argument('--random-state', default=None, type=int,
+                help='shuffle the pool like get_multiple_data_df with this RANDOM_STATE before splitting')
+    score_parser.add_argument('--output-csv', required=True, type=str)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args)
+    else:
+        score(args)
@@ -2,34 +2,21 @@ import matplotlib
 matplotlib.use('Agg')
 
 import pandas as pd
-from io import StringIO
 import matplotlib.pyplot as plt
 from scipy import stats
 
+from group_table import load_group_table, group_frames
+
 
 def calculate_correlation():
     # ATDS データの読み込み
     df1 = pd.read_csv("/work/result/ATDS_hindi_21_20000_3.csv")
     
-    # hindi18sec_6000_data.csv の読み込み
-    df2 = pd.read_csv("/work/result/hindi_21sec_20000_train_3.csv")
-    
-    # 各グループ内のデータフレームを解析して num_frames の合計を計算
-    total_frames = []
+    # グループ表の読み込み
+    group_table = load_group_table("/work/result/hindi_21sec_20000_train_3.parquet")
     
-    for _, row in df2.iterrows():
-        # 文字列データをデータフレームとして解析
-        print(row["data"])
-        try:
-            group_df = pd.read_csv(StringIO(row['data']), delim_whitespace=True)
-            # グループ内の num_frames の合計を計算
-            total = group_df['num_frames'].sum()
-            total_frames.append(total)
-        except Exception as e:
-            print(f"Error processing row: {row['index']}")
-            print(f"Error: {e}")
-            print(f"Data: {row['data'][:100]}...")
-            raise
+    # 各グループの num_frames の合計を計算
+    total_frames = group_frames(group_table).to_numpy()
     
     # 結果を新しいデータフレームにまとめる
     result_df = pd.DataFrame({
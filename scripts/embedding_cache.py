@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Default size bound of the on-disk cache (~290 hours of float32 1024-dim codes)
+MAX_CACHE_BYTES = 200 * 2**30
+# Eviction frees space down to this fraction of max_bytes, so it does not rescan the cache on every put
+EVICT_TO = 0.9
+
+def file_sha256(path, chunk_size=2**20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk cache of extraction results.
+
+    An entry holds what iter_speech_embeddings yields for one wav file (VAD
+    speech timestamps, sample rate, number of samples and the layer outputs)
+    and is keyed by the sha256 of the audio bytes, the sha256 of the model
+    checkpoint, the layer set and the VAD parameters. Files without voice
+    activity are cached too, so they are not re-run through VAD.
+
+    Entries are .npz files under cache_dir/<key[:2]>/. A hit refreshes the
+    file's mtime, and when the cache grows past max_bytes the least recently
+    used entries are deleted.
+
+    Embeddings are stored as float32, so cached and freshly computed results
+    are identical. A narrower dtype halves the disk use; put() then returns
+    the rounded embeddings, which callers should use on a miss too, so that
+    cold and warm runs still give the same cluster ids.
+    """
+
+    def __init__(self, cache_dir, checkpoint_path, max_bytes=MAX_CACHE_BYTES, dtype=np.float32):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.checkpoint_hash = self._checkpoint_hash(checkpoint_path)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _checkpoint_hash(self, checkpoint_path):
+        # Hashing a 1.2 GB checkpoint takes a few seconds, so remember it per (path, size, mtime)
+        stat = os.stat(checkpoint_path)
+        memo_file = self.cache_dir / "checkpoints.json"
+        try:
+            memo = json.loads(memo_file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Missing, or left broken by an older version; the hash is simply recomputed
+            memo = {}
+        memo_key = f"{os.path.abspath(checkpoint_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+        if memo_key not in memo:
+            memo[memo_key] = file_sha256(checkpoint_path)
+            # Other workers may read the memo at any time, so never let them see it half written
+            tmp_file = memo_file.with_name(f"{memo_file.name}.{os.getpid()}.tmp")
+            tmp_file.write_text(json.dumps(memo, indent=2))
+            os.replace(tmp_file, memo_file)
+        return memo[memo_key]
+
+    def _entries(self):
+        """(mtime_ns, size, path) of every entry, skipping entries another process deletes meanwhile."""
+        entries = []
+        for path in self.cache_dir.glob("*/*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def key(self, wav_path, layers, vad_params=None):
+        h = hashlib.sha256()
+        h.update(file_sha256(wav_path).encode())
+        h.update(self.checkpoint_hash.encode())
+        h.update(str(tuple(layers)).encode())
+        h.update(json.dumps(vad_params or {}, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.npz"
+
+    def get(self, key):
+        """
+        Returns:
+        tuple or None: (speech_timestamps, sample_rate, num_samples, embeddings)
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                timestamps = entry["speech_timestamps"]
+                result = (
+                    [{'start': int(s), 'end': int(e)} for s, e in timestamps],
+                    int(entry["sample_rate"]),
+                    int(entry["num_samples"]),
+                    entry["embeddings"].astype(np.float32),
+                )
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another worker after it was read; the entry read is still valid
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, key, speech_timestamps, sample_rate, num_samples, embeddings):
+        """
+        Returns:
+        np.ndarray: embeddings as get() will return them, i.e. rounded to the cache dtype and back to float32
+        """
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        timestamps = np.array([[t['start'], t['end']] for t in speech_timestamps], dtype=np.int64).reshape(-1, 2)
+
+        # Write under a temporary name so a crash never leaves a truncated entry behind
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        stored = np.asarray(embeddings, dtype=self.dtype)
+        with open(tmp_path, "wb") as f:
+            np.savez(f, speech_timestamps=timestamps, sample_rate=sample_rate, num_samples=num_samples,
+                     embeddings=stored)
+        # Sized before it is published, since another worker's evict() may delete it right after
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        return stored.astype(np.float32)
+
+    def evict(self):
+        """Delete least recently used entries until the cache is back under EVICT_TO * max_bytes."""
+        entries = sorted(self._entries())
+        self.total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes * EVICT_TO:
+                break
+            path.unlink(missing_ok=True)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "total_bytes": self.total_bytes,
+        }
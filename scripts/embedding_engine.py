@@ -0,0 +1,214 @@
+import torch
+import torchaudio
+import torch.nn.functional as F
+
+import numpy as np
+
+# Padded audio samples (16 kHz) allowed in one forward pass. Files longer than
+# this still get a batch of their own.
+MAX_BATCH_FRAMES = 16_000 * 120
+
+def get_model(checkpoint_path, device='cuda'):
+    """fairseq wav2vec2 model of a checkpoint, in eval mode on device."""
+    import fairseq
+
+    models, _, _ = fairseq.checkpoint_utils.load_model_ensemble_and_task([checkpoint_path])
+    model = models[0]
+    model.eval()
+    model.to(device)
+    return model
+
+def truncate_encoder(model, num_layers):
+    """
+    Drop the transformer blocks after the first num_layers of a fairseq
+    wav2vec2 model, in place. The conv feature extractor and the first
+    num_layers blocks are untouched, so layer_results[num_layers - 1] is the
+    same as the full model's; the remaining blocks are neither run nor kept
+    in memory. ATDS only needs layer 12 of the 24-layer XLS-R.
+    """
+    if num_layers > len(model.encoder.layers):
+        raise ValueError(f"Model has only {len(model.encoder.layers)} transformer layers, asked for {num_layers}")
+    model.encoder.layers = model.encoder.layers[:num_layers]
+    return model
+
+def make_batches(num_frames, max_batch_frames=MAX_BATCH_FRAMES, bucket_size=None):
+    """
+    Sort utterances by length and pack them into batches so that
+    (longest utterance in batch) * (batch size) stays under max_batch_frames.
+
+    Parameters:
+    num_frames (list of int): number of audio samples of each utterance
+    max_batch_frames (int): padded sample budget per batch
+    bucket_size (int): optional. Only utterances with the same num_frames // bucket_size share a batch
+
+    Returns:
+    list of list of int: indices into num_frames, one list per batch
+    """
+    num_frames = np.asarray(num_frames)
+    batches = []
+    cur_batch = []
+
+    for idx in np.argsort(num_frames, kind="stable"):
+        # Sorted ascending, so the current utterance is the longest of the batch
+        new_bucket = bucket_size is not None and cur_batch and num_frames[idx] // bucket_size != num_frames[cur_batch[0]] // bucket_size
+        if cur_batch and (new_bucket or num_frames[idx] * (len(cur_batch) + 1) > max_batch_frames):
+            batches.append(cur_batch)
+            cur_batch = []
+        cur_batch.append(int(idx))
+
+    if cur_batch:
+        batches.append(cur_batch)
+
+    return batches
+
+def collate_wavs(wavs):
+    """
+    Layer-normalize each waveform over its own length (as the per-file path
+    does) and zero-pad them into a (B, T) batch.
+
+    Returns:
+    tuple: (source tensor, padding mask with True at padded samples)
+    """
+    lengths = [wav.shape[-1] for wav in wavs]
+    source = torch.zeros(len(wavs), max(lengths))
+    padding_mask = torch.ones(len(wavs), max(lengths), dtype=torch.bool)
+
+    for i, wav in enumerate(wavs):
+        wav = wav.reshape(-1)
+        source[i, :lengths[i]] = F.layer_norm(wav, wav.shape)
+        padding_mask[i, :lengths[i]] = False
+
+    return source, padding_mask
+
+def forward_batch(model, wavs, layers=(12,), device='cuda'):
+    """
+    Run one padded batch through a fairseq wav2vec2 model and split the
+    outputs of the transformer layers in `layers` (1-based) back per file.
+
+    To skip the blocks above max(layers), truncate the model once with
+    truncate_encoder.
+
+    Returns:
+    list of np.ndarray: (num_codes, len(layers), dim) float32 array per input waveform
+    """
+    source, padding_mask = collate_wavs(wavs)
+
+    with torch.no_grad():
+        encoder_out = model(
+            source.to(device),
+            padding_mask=padding_mask.to(device) if padding_mask.any() else None,
+            features_only=True,
+            mask=False
+        )
+        # layer_results hold (T, B, C) tensors; stack them to (B, T, L, C)
+        layer_out = torch.stack([encoder_out['layer_results'][l - 1][0] for l in layers], dim=2).transpose(0, 1)
+
+    out_mask = encoder_out['padding_mask']
+    if out_mask is None:
+        num_codes = [layer_out.shape[1]] * len(wavs)
+    else:
+        num_codes = (~out_mask).sum(dim=1).tolist()
+
+    layer_out = layer_out.float().cpu().numpy()
+    return [layer_out[i, :n] for i, n in enumerate(num_codes)]
+
+def forward_single(model, wav, layers=(12,), device='cuda'):
+    """Per-file reference path, identical to the original getembeddings loop."""
+    with torch.no_grad():
+        normed_wav = F.layer_norm(wav, wav.shape)
+        encoder_out = model(normed_wav.to(device), features_only=True, mask=False)
+        return np.stack([
+            encoder_out['layer_results'][l - 1][0].transpose(0, 1).squeeze(0).cpu().numpy() for l in layers
+        ], axis=1)
+
+def code_times(num_codes, wav_dur_in_seconds):
+    """Start and end time (seconds) of each code, spread evenly over the file."""
+    start_times = np.linspace(0.00, wav_dur_in_seconds, num_codes, endpoint=False)
+    end_times = np.concatenate([start_times[1:], np.array([wav_dur_in_seconds])])
+    return start_times, end_times
+
+def speech_code_indices(start_times, end_times, speech_starts, speech_ends):
+    """
+    Indices of the codes with start >= interval start and end <= interval end,
+    interval by interval. Same rows, in the same order, as
+    speech_intervals.merge(codes, how="cross").query(...), found with two
+    searchsorted calls instead of an intervals x codes table.
+    """
+    lo = np.searchsorted(start_times, speech_starts, side='left')
+    hi = np.searchsorted(end_times, speech_ends, side='right')
+    lengths = np.clip(hi - lo, 0, None)
+
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets - lo, lengths)
+
+def align_speech_codes(speech_timestamps, sample_rate, num_samples, embeddings):
+    """
+    Keep only the codes that fall inside the VAD speech intervals.
+
+    Returns:
+    tuple: (start_times, end_times, embeddings) of the kept codes
+    """
+    start_times, end_times = code_times(embeddings.shape[0], num_samples/sample_rate)
+    speech_starts = np.array([t['start'] for t in speech_timestamps]) / sample_rate
+    speech_ends = np.array([t['end'] for t in speech_timestamps]) / sample_rate
+
+    idx = speech_code_indices(start_times, end_times, speech_starts, speech_ends)
+    return start_times[idx], end_times[idx], embeddings[idx]
+
+def iter_speech_embeddings(model, wav_dir, wav_files, get_speech_timestamps, vad_model,
+                           num_frames=None, layers=(12,), max_batch_frames=MAX_BATCH_FRAMES, device='cuda',
+                           vad_params=None, cache=None):
+    """
+    Batched replacement for the per-file forward pass in getembeddings.
+
+    Files are run through VAD first; files without voice activity are skipped
+    and the rest are forwarded in length-bucketed batches. Results come out in
+    batch (i.e. length-sorted) order, not in the order of wav_files.
+
+    vad_params are passed on to get_speech_timestamps. With an EmbeddingCache,
+    cached files are yielded first and only the misses reach VAD and the model.
+
+    Yields:
+    tuple: (wav_file, speech_timestamps, sample_rate, num_samples, embeddings),
+    embeddings being a (num_codes, len(layers), dim) array
+    """
+    vad_params = vad_params or {}
+    if num_frames is None:
+        num_frames = [torchaudio.info(wav_dir + "/" + f).num_frames for f in wav_files]
+
+    cache_keys = {}
+    if cache is not None:
+        todo = []
+        for idx, wav_file in enumerate(wav_files):
+            cache_keys[idx] = cache.key(wav_dir + "/" + wav_file, layers, vad_params)
+            cached = cache.get(cache_keys[idx])
+            if cached is None:
+                todo.append(idx)
+            elif len(cached[0]) > 0:
+                yield (wav_file,) + cached
+    else:
+        todo = list(range(len(wav_files)))
+
+    for batch in make_batches([num_frames[idx] for idx in todo], max_batch_frames):
+        items = []
+        for idx in (todo[i] for i in batch):
+            wav_data, sample_rate = torchaudio.load(wav_dir + "/" + wav_files[idx])
+            speech_timestamps = get_speech_timestamps(wav_data, vad_model, sampling_rate=sample_rate, **vad_params)
+
+            # If no voice activity detected, skip clip
+            if len(speech_timestamps) == 0:
+                if cache is not None:
+                    cache.put(cache_keys[idx], speech_timestamps, sample_rate, wav_data.shape[1], np.empty((0, 0)))
+                continue
+            items.append((idx, speech_timestamps, sample_rate, wav_data))
+
+        if not items:
+            continue
+
+        embeddings = forward_batch(model, [item[3] for item in items], layers=layers, device=device)
+
+        for (idx, speech_timestamps, sample_rate, wav_data), emb in zip(items, embeddings):
+            if cache is not None:
+                # Yield what a later hit would return, so results do not depend on the cache being warm
+                emb = cache.put(cache_keys[idx], speech_timestamps, sample_rate, wav_data.shape[1], emb)
+            yield wav_files[idx], speech_timestamps, sample_rate, wav_data.shape[1], emb
@@ -0,0 +1,264 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EMBEDDING_DIM = 1024
+ROW_GROUP_SIZE = 20_000
+
+# Embedding store layout (a directory, conventionally named *.emb):
+#   embeddings_layer<N>.bin  (num_rows, dim) matrix of transformer layer N, row-major,
+#                            dtype from meta.json; one file per extracted layer
+#   code_times.bin           (num_rows, 2) float64 code start/end times in seconds
+#   utterances.parquet       wav_file, offset, num_codes; rows of one file are contiguous
+#   meta.json                format version, dim, dtype, num_rows, model, layers
+STORE_VERSION = 2
+
+def embedding_cols(dim=EMBEDDING_DIM):
+    return [f"e{i:03}" for i in range(dim)]
+
+class EmbeddingParquetWriter:
+    """
+    Streams per-utterance frames into a parquet file with the same columns the
+    extraction scripts always wrote (wav_file, code_start_time, code_end_time,
+    e000..e1023), one row group at a time.
+
+    Frames are staged in a preallocated column-major buffer of row_group_size
+    rows, so memory stays at one row group regardless of how many hours are
+    extracted.
+    """
+
+    def __init__(self, output_parquet, dim=EMBEDDING_DIM, row_group_size=ROW_GROUP_SIZE, dtype=np.float32):
+        self.output_parquet = output_parquet
+        self.dim = dim
+        self.row_group_size = row_group_size
+        self.cols = embedding_cols(dim)
+        self.schema = pa.schema(
+            [("wav_file", pa.string()), ("code_start_time", pa.float64()), ("code_end_time", pa.float64())] +
+            [(c, pa.from_numpy_dtype(dtype)) for c in self.cols]
+        )
+
+        self._emb_buf = np.empty((dim, row_group_size), dtype=dtype)
+        self._start_buf = np.empty(row_group_size, dtype=np.float64)
+        self._end_buf = np.empty(row_group_size, dtype=np.float64)
+        self._wav_files = []
+        self._num_buffered = 0
+        self.num_rows = 0
+
+        self._writer = pq.ParquetWriter(str(output_parquet), self.schema)
+
+    def write(self, wav_file, start_times, end_times, embeddings):
+        """Append the (num_codes, dim) or single-layer (num_codes, 1, dim) embeddings of one utterance."""
+        if embeddings.ndim == 3:
+            if embeddings.shape[1] != 1:
+                raise ValueError("A parquet file holds a single layer; write several layers to an embedding store")
+            embeddings = embeddings[:, 0]
+
+        pos = 0
+        while pos < len(embeddings):
+            n = min(len(embeddings) - pos, self.row_group_size - self._num_buffered)
+            dst = slice(self._num_buffered, self._num_buffered + n)
+            self._emb_buf[:, dst] = embeddings[pos:pos + n].T
+            self._start_buf[dst] = start_times[pos:pos + n]
+            self._end_buf[dst] = end_times[pos:pos + n]
+            self._wav_files.extend([wav_file] * n)
+            self._num_buffered += n
+            pos += n
+
+            if self._num_buffered == self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        n = self._num_buffered
+        if n == 0:
+            return
+        arrays = [pa.array(self._wav_files, pa.string()), pa.array(self._start_buf[:n]), pa.array(self._end_buf[:n])]
+        arrays += [pa.array(self._emb_buf[i, :n]) for i in range(self.dim)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+        self.num_rows += n
+        self._wav_files = []
+        self._num_buffered = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class EmbeddingStoreWriter:
+    """
+    Writes the embedding store format described at the top of this module.
+    Same write() interface as EmbeddingParquetWriter; frames are appended to
+    the raw files as they arrive, so nothing but the utterance index is kept
+    in memory.
+    """
+
+    def __init__(self, store_dir, dim=EMBEDDING_DIM, dtype=np.float16, model=None, layers=(12,)):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.model = model
+        self.layers = list(layers)
+        self.num_rows = 0
+
+        self._wav_files = []
+        self._offsets = []
+        self._num_codes = []
+        self._emb_files = [open(self.store_dir / f"embeddings_layer{l}.bin", "wb") for l in self.layers]
+        self._times_file = open(self.store_dir / "code_times.bin", "wb")
+
+    def write(self, wav_file, start_times, end_times, embeddings):
+        """
+        Append the embeddings of one utterance: (num_codes, len(layers), dim),
+        or (num_codes, dim) for a single-layer store.
+        """
+        if embeddings.ndim == 2:
+            embeddings = embeddings[:, None]
+        if embeddings.shape[1] != len(self.layers):
+            raise ValueError(f"Got {embeddings.shape[1]} layers for a store of layers {self.layers}")
+
+        if self._wav_files and self._wav_files[-1] == wav_file:
+            # Continuation of the previous utterance (e.g. split across parquet row groups)
+            self._num_codes[-1] += len(embeddings)
+        else:
+            self._wav_files.append(wav_file)
+            self._offsets.append(self.num_rows)
+            self._num_codes.append(len(embeddings))
+
+        for i, emb_file in enumerate(self._emb_files):
+            np.ascontiguousarray(embeddings[:, i], dtype=self.dtype).tofile(emb_file)
+        np.column_stack([start_times, end_times]).astype(np.float64).tofile(self._times_file)
+        self.num_rows += len(embeddings)
+
+    def close(self):
+        for emb_file in self._emb_files:
+            emb_file.close()
+        self._times_file.close()
+
+        pd.DataFrame({
+            "wav_file": self._wav_files,
+            "offset": np.array(self._offsets, dtype=np.int64),
+            "num_codes": np.array(self._num_codes, dtype=np.int64),
+        }).to_parquet(self.store_dir / "utterances.parquet", index=False)
+
+        meta = {
+            "version": STORE_VERSION,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "num_rows": self.num_rows,
+            "model": None if self.model is None else str(self.model),
+            "layers": self.layers,
+        }
+        with open(self.store_dir / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class EmbeddingStore:
+    """
+    Read-only view of an embedding store. Layer matrices and `code_times` are
+    np.memmap arrays, so slicing them never copies the whole matrix.
+    `embeddings` is the first stored layer; layer_embeddings(n) any other.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / "meta.json") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported embedding store version {self.meta['version']} in {store_dir}")
+
+        self.dim = self.meta["dim"]
+        self.num_rows = self.meta["num_rows"]
+        self.utterances = pd.read_parquet(self.store_dir / "utterances.parquet")
+        self.layers = self.meta["layers"]
+        self.embeddings = self.layer_embeddings(self.layers[0])
+        self.code_times = self._memmap("code_times.bin", "float64", 2)
+
+    def _memmap(self, name, dtype, width):
+        if self.num_rows == 0:
+            return np.empty((0, width), dtype=dtype)
+        return np.memmap(self.store_dir / name, dtype=dtype, mode="r", shape=(self.num_rows, width))
+
+    def layer_embeddings(self, layer):
+        if layer not in self.layers:
+            raise ValueError(f"Layer {layer} not in embedding store {self.store_dir} (layers {self.layers})")
+        return self._memmap(f"embeddings_layer{layer}.bin", self.meta["dtype"], self.dim)
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def wav_files(self):
+        """wav_file of every row, as the parquet format stored it."""
+        return np.repeat(self.utterances.wav_file.to_numpy(), self.utterances.num_codes.to_numpy())
+
+    def utterance(self, idx):
+        """(wav_file, embeddings view) of the idx-th utterance."""
+        row = self.utterances.iloc[idx]
+        return row.wav_file, self.embeddings[row.offset:row.offset + row.num_codes]
+
+def is_parquet(path):
+    return str(path).endswith(".parquet")
+
+def open_embedding_writer(output_path, **kwargs):
+    """Parquet writer for *.parquet paths, embedding store writer otherwise."""
+    if is_parquet(output_path):
+        kwargs.pop("model", None)
+        if len(kwargs.pop("layers", (12,))) != 1:
+            raise ValueError("A parquet file holds a single layer; write several layers to an embedding store")
+        return EmbeddingParquetWriter(output_path, **kwargs)
+    return EmbeddingStoreWriter(output_path, **kwargs)
+
+def load_embeddings(path, dim=EMBEDDING_DIM, layer=None):
+    """
+    Load extracted embeddings from either format. `layer` selects a layer of a
+    multi-layer store (default: its first layer); parquet files hold one layer.
+
+    Returns:
+    tuple: (wav_file of every row, (num_rows, dim) embedding matrix). For an
+    embedding store the matrix is a zero-copy memmap.
+    """
+    if is_parquet(path):
+        cols = embedding_cols(dim)
+        df = pd.read_parquet(path, columns=["wav_file"] + cols)
+        return df.wav_file.to_numpy(), df[cols].to_numpy(dtype=np.float32)
+
+    store = EmbeddingStore(path)
+    return store.wav_files, store.embeddings if layer is None else store.layer_embeddings(layer)
+
+def convert_parquet_to_store(parquet_path, store_dir, dim=EMBEDDING_DIM, dtype=np.float16, model=None, layer=12):
+    """Rewrite an e000..e1023 column parquet as an embedding store, one row group at a time."""
+    cols = embedding_cols(dim)
+    parquet_file = pq.ParquetFile(parquet_path)
+
+    with EmbeddingStoreWriter(store_dir, dim=dim, dtype=dtype, model=model, layers=(layer,)) as writer:
+        for i in range(parquet_file.num_row_groups):
+            df = parquet_file.read_row_group(i, columns=["wav_file", "code_start_time", "code_end_time"] + cols).to_pandas()
+            # Rows of one wav file are contiguous, but may straddle row groups
+            for wav_file, utt_df in df.groupby("wav_file", sort=False):
+                writer.write(wav_file, utt_df.code_start_time.to_numpy(), utt_df.code_end_time.to_numpy(),
+                             utt_df[cols].to_numpy())
+    return writer
+
+if __name__ == "__main__":
+    import sys
+
+    parquet_path = sys.argv[1]
+    store_dir = sys.argv[2]
+
+    writer = convert_parquet_to_store(parquet_path, store_dir)
+    print(f"Wrote {writer.num_rows} frames to {store_dir}")
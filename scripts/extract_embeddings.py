@@ -1,26 +1,18 @@
 import torch
 import torchaudio
-import torch.nn.functional as F
 
 from pathlib import Path
 import pandas as pd
-import numpy as np
 import argparse
 from tqdm import tqdm
 import time
 
-import fairseq
+from embedding_engine import get_model, iter_speech_embeddings, align_speech_codes, truncate_encoder, MAX_BATCH_FRAMES
+from embedding_store import open_embedding_writer
+from embedding_cache import EmbeddingCache
 
-torch.set_num_threads(1)
 RANDOM_STATE = int(time.time())
 
-def get_model(checkpoint_path):
-    models, _, _ = fairseq.checkpoint_utils.load_model_ensemble_and_task([ checkpoint_path ])
-    model = models[0]
-    model.eval()
-    model.to('cuda')
-    return model
-
 def get_data_df(wav_dir, num_hours, manifest_path=None):
     if manifest_path is None:
         data_path = Path(wav_dir)
@@ -79,6 +71,8 @@ def get_multiple_data_df(wav_dir, num_hours, num_sets, manifest_path=None):
 def run(args):
     print(f'Getting model from {args.checkpoint_path}')
     model = get_model(args.checkpoint_path)
+    if args.stop_at_deepest_layer:
+        model = truncate_encoder(model, max(args.layers))
     print('Done!')
 
     print(f'Getting {args.num_hours} hours of data from {args.wav_dir} for {args.num_sets} sets')
@@ -90,49 +84,29 @@ def run(args):
     (get_speech_timestamps, _, _, VADIterator, collect_chunks) = vad_utils
     print('Done!')
     
+    embedding_cache = None
+    if args.cache_dir is not None:
+        embedding_cache = EmbeddingCache(args.cache_dir, args.checkpoint_path, max_bytes=int(args.cache_max_gb * 2**30))
+
     print('Begin Extraction')
-    embedding_cols = [f"e{i:03}" for i in range(1024)]
-    final_speech_df = pd.DataFrame(columns=["wav_file", "code_start_time", "code_end_time"] + embedding_cols)
-    
     for dataset_idx, data_df in enumerate(datasets):
         print(f'Processing dataset {dataset_idx + 1} of {len(datasets)}')
-        for idx, vals in tqdm(data_df.iterrows(), total=data_df.shape[0]):
-            wav_file = vals['path']
-            wav_data, sample_rate = torchaudio.load(args.wav_dir + "/" + wav_file)
-
-            speech_timestamps = get_speech_timestamps(wav_data, vad_model, sampling_rate=sample_rate)
-            speech_intervals = pd.DataFrame(speech_timestamps)
-
-            # If no voice activity detected, skip clip
-            if len(speech_intervals) == 0:
-                continue
-
-            with torch.no_grad():
-                normed_wav = F.layer_norm(wav_data, wav_data.shape)
-                encoder_out = model(normed_wav.to('cuda'), features_only=True, mask=False)
-                layer12_embeddings = encoder_out['layer_results'][12 - 1][0].transpose(0,1).squeeze(0).cpu().numpy()
-                
-            embeddings_df = pd.DataFrame(layer12_embeddings, columns=embedding_cols)
-            wav_dur_in_seconds = wav_data.shape[1]/sample_rate
-
-            start_times = np.linspace(0.00, wav_dur_in_seconds, layer12_embeddings.shape[0], endpoint=False)
-            end_times = np.concatenate([start_times[1:], np.array([wav_dur_in_seconds])])
-            embeddings_df["code_start_time"] = start_times
-            embeddings_df["code_end_time"] = end_times
-
-            speech_intervals.start /= sample_rate
-            speech_intervals.end /= sample_rate
-
-            speech_codes = speech_intervals.merge(embeddings_df, how="cross").query("code_start_time >= start and code_end_time <= end")
-            speech_codes["wav_file"] = wav_file
-            cur_speech_df = speech_codes[["wav_file", "code_start_time", "code_end_time"] + embedding_cols]
-
-            final_speech_df = pd.concat([final_speech_df, cur_speech_df], ignore_index=True, sort=False)
-
-    print(f'Saving to {args.output_parquet}')
-    final_speech_df.to_parquet(args.output_parquet)
+        suffix = ".parquet" if args.output_format == "parquet" else ".emb"
+        output_path = Path(args.output_dir) / f"{args.output_prefix}{dataset_idx + 1}_{suffix}"
+        extracted = iter_speech_embeddings(model, args.wav_dir, data_df.path.to_list(), get_speech_timestamps, vad_model,
+                                           num_frames=data_df.num_frames.to_list(), max_batch_frames=args.max_batch_frames,
+                                           layers=args.layers, cache=embedding_cache)
+        with open_embedding_writer(output_path, model=args.checkpoint_path, layers=args.layers) as writer:
+            for wav_file, speech_timestamps, sample_rate, num_samples, layer_embeddings in tqdm(extracted, total=data_df.shape[0]):
+                start_times, end_times, speech_embeddings = align_speech_codes(speech_timestamps, sample_rate, num_samples, layer_embeddings)
+                writer.write(wav_file, start_times, end_times, speech_embeddings)
+
+        print(f'Saved {writer.num_rows} frames to {output_path}')
+        if embedding_cache is not None:
+            print(f'Embedding cache: {embedding_cache.stats()}')
     
 if __name__ == "__main__":
+    torch.set_num_threads(1)
     parser = argparse.ArgumentParser(description='Extract Codebook Indices Based on a Trained Model')
 
     parser.add_argument('--checkpoint-path', required=True, type=str,
@@ -145,11 +119,25 @@ if __name__ == "__main__":
                 help='number of hours to subset (default=5, can be a float)')
     parser.add_argument('--num-sets', default=1000, type=int,
                 help='number of datasets (default=1000)')
+    parser.add_argument('--layers', nargs='+', default=[12], type=int,
+                help='transformer layers to extract in one forward pass (default=12). '
+                     'Several layers need --output-format store')
+    parser.add_argument('--stop-at-deepest-layer', action='store_true',
+                help='drop the encoder blocks after the deepest requested layer, so they are never run')
+    parser.add_argument('--max-batch-frames', default=MAX_BATCH_FRAMES, type=int,
+                help=f'padded audio samples per forward pass (default={MAX_BATCH_FRAMES})')
     # --output-parquetを削除し、新しい引数を追加
     parser.add_argument('--output-prefix', required=True, type=str,
                 help='prefix for output parquet files (eg. "hindi" will create hindi1_.parquet)')
     parser.add_argument('--output-dir', default='.', type=str,
                 help='directory to save output parquet files (default: current directory)')
+    parser.add_argument('--output-format', default='store', choices=['store', 'parquet'],
+                help='"store" writes memory-mapped float16 embedding stores (hindi1_.emb), '
+                     '"parquet" the old e000..e1023 column parquet (default=store)')
+    parser.add_argument('--cache-dir', default=None, type=str,
+                help='optional. Reuse embeddings of previously extracted audio from this cache directory')
+    parser.add_argument('--cache-max-gb', default=200, type=float,
+                help='size bound of the embedding cache in GiB (default=200)')
 
     args = parser.parse_args()
 
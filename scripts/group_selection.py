@@ -0,0 +1,76 @@
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+# Manifest lines joined and written at a time by write_manifest
+MANIFEST_CHUNK_LINES = 10_000
+
+def top_k(scores, k, by=None, ascending=False):
+    """
+    Ids of the k best groups of a score table, best first, without sorting
+    the whole table: argpartition finds the k-th best value of the first
+    key, and only the groups at least that good are sorted on all keys.
+    Ties keep the order of the table, as sorted() over the score dict did.
+    Groups with a nan key are never selected.
+
+    Parameters:
+    scores (pd.Series or pd.DataFrame): scores indexed by group_id
+    by (str or list): column(s) of a DataFrame to sort on, the first one first
+    ascending (bool or list): per key, whether smaller is better
+
+    Returns:
+    pd.Index: group ids of the (at most) k selected groups
+    """
+    if isinstance(scores, pd.Series):
+        scores = scores.to_frame()
+        by = scores.columns[0]
+    by = list(by) if isinstance(by, (list, tuple)) else [by]
+    ascending = list(ascending) if isinstance(ascending, (list, tuple)) else [ascending] * len(by)
+
+    # Every key oriented so that smaller is better
+    keys = [scores[col].to_numpy(np.float64) * (1 if asc else -1) for col, asc in zip(by, ascending)]
+    valid = np.flatnonzero(~np.isnan(np.column_stack(keys)).any(axis=1))
+    keys = [key[valid] for key in keys]
+    k = min(k, len(valid))
+    if k == 0:
+        return scores.index[:0]
+
+    candidates = np.arange(len(valid))
+    if k < len(valid):
+        kth = keys[0][np.argpartition(keys[0], k - 1)[k - 1]]
+        candidates = np.flatnonzero(keys[0] <= kth)
+    # lexsort sorts on the last key first and is stable
+    order = np.lexsort([key[candidates] for key in reversed(keys)])[:k]
+    return scores.index[valid[candidates[order]]]
+
+def manifest_lines(data_rows):
+    """
+    Yields:
+    str: "path<TAB>num_frames" of every distinct file of data_rows, in the order they first appear
+    """
+    seen = set()
+    for path, num_frames in zip(data_rows.path.tolist(), data_rows.num_frames.tolist()):
+        if (path, num_frames) not in seen:
+            seen.add((path, num_frames))
+            yield f"{path}\t{num_frames}"
+
+def write_manifest(data_rows, output_file):
+    """
+    Stream the manifest of data_rows (see manifest_lines) to output_file,
+    lines joined by newlines as the sort_by_* scripts wrote them. Written
+    to a temporary file first, so a failed run leaves no partial manifest.
+
+    Returns:
+    int: number of files written
+    """
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    num_lines = 0
+    lines = manifest_lines(data_rows)
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        while chunk := list(itertools.islice(lines, MANIFEST_CHUNK_LINES)):
+            f.write(("\n" if num_lines else "") + "\n".join(chunk))
+            num_lines += len(chunk)
+    os.replace(tmp_file, output_file)
+    return num_lines
@@ -0,0 +1,121 @@
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+GROUP_COLUMNS = ["group_id", "path", "num_frames"]
+# Last line of a DataFrame repr that pandas truncated
+LEGACY_FOOTER = re.compile(r"^\[(\d+) rows x (\d+) columns\]$")
+
+def make_group_table(datasets):
+    """
+    Long table of donor groups, one row per file.
+
+    Parameters:
+    datasets (list of pd.DataFrame): groups with path and num_frames columns, e.g. from get_multiple_data_df
+
+    Returns:
+    pd.DataFrame: group_id, path, num_frames; group i is datasets[i]
+    """
+    sizes = [len(df) for df in datasets]
+    return pd.DataFrame({
+        "group_id": np.repeat(np.arange(len(datasets), dtype=np.int64), sizes),
+        "path": np.concatenate([df.path.astype(str).to_numpy() for df in datasets]) if datasets else np.empty(0, dtype=object),
+        "num_frames": np.concatenate([df.num_frames.to_numpy(dtype=np.int64) for df in datasets]) if datasets else np.empty(0, dtype=np.int64),
+    })
+
+def save_group_table(group_table, path):
+    group_table[GROUP_COLUMNS].to_parquet(path, index=False)
+
+def load_group_table(path):
+    """
+    Load donor groups written by save_group_table. A .csv path is read as
+    the old format (str(DataFrame) per "data" cell) with read_legacy_csv.
+
+    Returns:
+    pd.DataFrame: path and num_frames of every file, indexed by group_id, groups in order
+    """
+    if str(path).endswith(".csv"):
+        group_table = read_legacy_csv(path)
+    else:
+        group_table = pd.read_parquet(path, columns=GROUP_COLUMNS)
+    return group_table.set_index("group_id")
+
+def read_legacy_csv(csv_path):
+    """
+    Parse the old group CSV, whose "data" cells hold str(DataFrame) text
+    (header line, then "index path num_frames" lines). Reprs that pandas
+    truncated (a ".." row in the middle and a "[n rows x m columns]"
+    footer) have lost files and can not be recovered; they are reported
+    and parsed as far as they go.
+
+    Returns:
+    pd.DataFrame: group_id, path, num_frames
+    """
+    raw_df = pd.read_csv(csv_path)
+    group_ids, paths, num_frames = [], [], []
+    num_truncated = 0
+    num_missing = 0
+
+    for group_id, data in enumerate(raw_df["data"]):
+        lines = data.strip().split("\n")
+        num_rows = 0
+        truncated = False
+        for line in lines[1:]:
+            parts = line.split()
+            footer = LEGACY_FOOTER.match(line.strip())
+            if footer:
+                # Footer of a truncated repr, with the number of rows before truncation
+                num_missing += max(int(footer.group(1)) - num_rows, 0)
+                truncated = True
+                continue
+            if parts and parts[0].startswith(".."):
+                truncated = True
+            if len(parts) != 3 or not parts[2].isdigit():
+                continue
+            group_ids.append(group_id)
+            paths.append(parts[1])
+            num_frames.append(int(parts[2]))
+            num_rows += 1
+        num_truncated += truncated
+
+    if num_truncated:
+        print(f"Warning: {num_truncated} groups of {csv_path} were saved truncated and miss {num_missing} files")
+    return pd.DataFrame({"group_id": np.asarray(group_ids, dtype=np.int64), "path": paths,
+                         "num_frames": np.asarray(num_frames, dtype=np.int64)})
+
+def grouped_paths(group_table):
+    """
+    Returns:
+    dict: group id -> list of its paths, in group order
+    """
+    group_ids = group_table.index.to_numpy()
+    paths = group_table.path.tolist()
+    # Rows of a group are contiguous in a saved table, so slice at the group boundaries
+    starts = np.flatnonzero(np.concatenate([[True], group_ids[1:] != group_ids[:-1]]))
+    ends = np.append(starts[1:], len(paths))
+    if len(np.unique(group_ids[starts])) != len(starts):
+        return {group_id: group_paths.tolist() for group_id, group_paths in group_table.path.groupby(level=0, sort=False)}
+    return {group_id: paths[start:end] for group_id, start, end in zip(group_ids[starts].tolist(), starts.tolist(), ends.tolist())}
+
+def group_frames(group_table):
+    """Total num_frames of every group."""
+    return group_table.num_frames.groupby(level=0, sort=False).sum()
+
+def group_rows(group_table, group_ids):
+    """
+    Files of the given groups, group after group in the order of group_ids.
+    Ids that are not in the table are skipped.
+
+    Returns:
+    pd.DataFrame: path and num_frames, indexed by group_id
+    """
+    group_ids = pd.Index(group_ids)
+    return group_table.loc[group_ids[group_ids.isin(group_table.index)]]
+
+if __name__ == "__main__":
+    # python group_table.py <old groups .csv> <groups .parquet>
+    group_table = read_legacy_csv(sys.argv[1])
+    save_group_table(group_table, sys.argv[2])
+    print(f"Saved {group_table.group_id.nunique()} groups, {len(group_table)} files to {sys.argv[2]}")
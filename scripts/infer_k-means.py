@@ -1,25 +1,25 @@
 import joblib
 import sys
 
-import numpy as np
 import pandas as pd
 
+from embedding_store import load_embeddings
+from kmeans_engine import CentroidAssigner
+
 km_model = sys.argv[1]
 input_file = sys.argv[2]
 output_file = sys.argv[3]
+# Optional: which layer of a multi-layer embedding store to cluster
+layer = int(sys.argv[4]) if len(sys.argv) > 4 else None
 
 km_model = joblib.load(km_model)
 
 lang_embeds_file = input_file
 print(f"Reading {lang_embeds_file}... ")
 
-embedding_cols = [ f"e{i:03}" for i in range(1024) ]
-
-lang_df = pd.read_parquet(
-    lang_embeds_file,
-    columns=["wav_file"] + embedding_cols
-)
+wav_files, embeddings = load_embeddings(lang_embeds_file, layer=layer)
+lang_df = pd.DataFrame({"wav_file": wav_files})
 
-lang_df["cluster_id"] = km_model.predict(np.array(lang_df[embedding_cols]).astype(float))
+lang_df["cluster_id"] = CentroidAssigner.from_model(km_model).predict(embeddings)
 
 lang_df[ ["wav_file", "cluster_id"] ].to_parquet(output_file)
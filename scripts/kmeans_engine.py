@@ -0,0 +1,187 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pyarrow.parquet as pq
+from threadpoolctl import threadpool_limits
+from tqdm import tqdm
+
+from embedding_store import EMBEDDING_DIM, embedding_cols, is_parquet, load_embeddings
+
+# Rows read from disk in one contiguous slice
+CHUNK_ROWS = 10_000
+# Chunks shuffled together; RAM is about CHUNKS_PER_BLOCK * CHUNK_ROWS * dim * 4 bytes
+CHUNKS_PER_BLOCK = 8
+
+def embedding_chunks(path, chunk_rows=CHUNK_ROWS, dim=EMBEDDING_DIM, layer=None):
+    """
+    Split extracted embeddings into chunks that can be read independently.
+
+    For an embedding store a chunk is a contiguous slice of the memmap; for a
+    parquet file it is a row group (parquet files written by pandas may have a
+    single huge row group, so convert them to a store for bounded memory).
+
+    Returns:
+    list of callables, each returning one chunk as a float32 (rows, dim) array
+    """
+    if is_parquet(path):
+        parquet_file = pq.ParquetFile(path)
+        cols = embedding_cols(dim)
+
+        def read_row_group(i):
+            table = parquet_file.read_row_group(i, columns=cols)
+            return np.column_stack([table.column(c).to_numpy() for c in cols]).astype(np.float32, copy=False)
+
+        return [lambda i=i: read_row_group(i) for i in range(parquet_file.num_row_groups)]
+
+    _, embeddings = load_embeddings(path, dim=dim, layer=layer)
+    return [
+        lambda start=start: np.asarray(embeddings[start:start + chunk_rows], dtype=np.float32)
+        for start in range(0, len(embeddings), chunk_rows)
+    ]
+
+def iter_shuffled_batches(chunks, batch_size, rng, chunks_per_block=CHUNKS_PER_BLOCK):
+    """
+    Endless stream of shuffled float32 batches. Every pass visits the chunks
+    in a new random order; chunks_per_block of them are read, concatenated
+    and row-shuffled together before being cut into batches.
+    """
+    while True:
+        order = rng.permutation(len(chunks))
+        for b in range(0, len(order), chunks_per_block):
+            block = np.concatenate([chunks[i]() for i in order[b:b + chunks_per_block]])
+            block = block[rng.permutation(len(block))]
+            for start in range(0, len(block), batch_size):
+                yield block[start:start + batch_size]
+
+def input_signature(path):
+    """Absolute path, size and mtime of an embeddings file, or of every file of an embedding store directory."""
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        files = sorted(os.scandir(path), key=lambda entry: entry.name)
+        return [path] + [[entry.name, entry.stat().st_size, entry.stat().st_mtime_ns] for entry in files if entry.is_file()]
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+def train_kmeans(chunks, km_model, max_steps, batch_size, checkpoint_path=None, checkpoint_every=50, seed=0,
+                 input_path=None):
+    """
+    Run max_steps MiniBatchKMeans.partial_fit steps over shuffled batches.
+
+    If checkpoint_path exists, training resumes from the model, step and RNG
+    state saved there; a new checkpoint is written every checkpoint_every
+    steps. A checkpoint of another run (different input_path signature,
+    n_clusters, batch_size or seed) is ignored and training
+    starts over.
+    """
+    rng = np.random.default_rng(seed)
+    first_step = 0
+    run = {
+        "input": input_signature(input_path) if input_path is not None else None,
+        "n_clusters": km_model.n_clusters,
+        "batch_size": batch_size,
+        "seed": seed,
+    }
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        state = joblib.load(checkpoint_path)
+        if state.get("run") == run:
+            km_model = state["model"]
+            first_step = state["step"]
+            rng.bit_generator.state = state["rng"]
+            print(f"Resuming from {checkpoint_path} at step {first_step}")
+        else:
+            print(f"{checkpoint_path} is from another input or setting, starting over")
+
+    batches = iter_shuffled_batches(chunks, batch_size, rng)
+    for step in tqdm(range(first_step, max_steps), initial=first_step, total=max_steps):
+        km_model.partial_fit(next(batches))
+
+        if checkpoint_path is not None and (step + 1) % checkpoint_every == 0:
+            # Write then rename, so an interrupted dump never replaces a good checkpoint
+            tmp_path = f"{checkpoint_path}.tmp"
+            joblib.dump({"model": km_model, "step": step + 1, "rng": rng.bit_generator.state, "run": run}, tmp_path)
+            os.replace(tmp_path, checkpoint_path)
+
+    return km_model
+
+# Rows assigned per GEMM; the (rows, n_clusters) float32 distance block is the per-thread working set
+ASSIGN_CHUNK_ROWS = 4096
+
+class CentroidAssigner:
+    """
+    Nearest-centroid assignment for a fitted k-means codebook.
+
+    Same computation as sklearn's KMeans.predict: ||c||^2 - 2 x.c in
+    float32, one GEMM per chunk of rows, first minimum wins. Centroid norms
+    are computed once, chunks are spread over a thread pool with
+    single-threaded BLAS, and the input (e.g. a float16 store memmap) is
+    only converted chunk by chunk.
+
+    Rows whose best and second best distances are closer than the float32
+    rounding bound are handed to km_model.predict (or recomputed in float64
+    without a model), so the labels do not depend on GEMM rounding.
+    """
+
+    def __init__(self, centers, km_model=None, chunk_rows=ASSIGN_CHUNK_ROWS, n_threads=None):
+        self.centers = np.ascontiguousarray(centers, dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", self.centers, self.centers)
+        self.km_model = km_model
+        self.chunk_rows = chunk_rows
+        self.n_threads = n_threads or os.cpu_count()
+
+        # Forward error of the float32 distances, relative to ||x|| * max||c|| and max||c||^2
+        u = np.finfo(np.float32).eps / 2
+        max_norm = float(np.sqrt(self.sq_norms.max()))
+        self.tol_coef = 4 * (self.centers.shape[1] + 2) * u * max_norm
+        self.tol_const = 4 * u * max_norm ** 2
+
+        self.num_ambiguous = 0
+
+    @classmethod
+    def from_model(cls, km_model, **kwargs):
+        return cls(km_model.cluster_centers_, km_model=km_model, **kwargs)
+
+    def _assign_chunk(self, X, start, labels):
+        x = np.asarray(X[start:start + self.chunk_rows], dtype=np.float32)
+        dist = x @ self.centers.T
+        dist *= -2
+        dist += self.sq_norms
+
+        rows = np.arange(len(x))
+        best = dist.argmin(axis=1)
+        best_dist = dist[rows, best]
+        dist[rows, best] = np.inf
+        gap = dist.min(axis=1) - best_dist
+
+        labels[start:start + len(x)] = best
+        tol = self.tol_coef * np.sqrt(np.einsum("ij,ij->i", x, x)) + self.tol_const
+        return start + np.flatnonzero(gap <= tol)
+
+    def _resolve(self, X, idx):
+        if self.km_model is not None:
+            return self.km_model.predict(np.asarray(X[idx], dtype=self.km_model.cluster_centers_.dtype))
+        x = np.asarray(X[idx], dtype=np.float64)
+        centers = self.centers.astype(np.float64)
+        return ((centers ** 2).sum(axis=1) - 2 * x @ centers.T).argmin(axis=1)
+
+    def predict(self, X):
+        """
+        Parameters:
+        X (array-like): (n, dim) embeddings, any float dtype
+
+        Returns:
+        np.ndarray: int32 cluster id of each row
+        """
+        labels = np.empty(len(X), dtype=np.int32)
+        starts = range(0, len(X), self.chunk_rows)
+
+        with threadpool_limits(limits=1, user_api="blas"), ThreadPoolExecutor(self.n_threads) as executor:
+            ambiguous = list(executor.map(lambda start: self._assign_chunk(X, start, labels), starts))
+
+        ambiguous = np.concatenate(ambiguous) if ambiguous else np.empty(0, dtype=np.int64)
+        self.num_ambiguous += len(ambiguous)
+        if len(ambiguous):
+            labels[ambiguous] = self._resolve(X, ambiguous)
+        return labels
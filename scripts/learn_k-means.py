@@ -1,40 +1,24 @@
 import joblib
+import os
 import sys
 
-import numpy as np
-import pandas as pd
-
 from sklearn.cluster import MiniBatchKMeans
-from torch.utils.data import Dataset, DataLoader
-from tqdm import tqdm
-
-class EmbedsForKMeans(Dataset):
- 
-  def __init__(self, embeddings_parquet):
 
-    embedding_cols = [ f"e{i:03}" for i in range(1024) ]
-    self.embeddings_df = pd.read_parquet(embeddings_parquet, columns=embedding_cols)
- 
-  def __len__(self):
-    return len(self.embeddings_df)
-   
-  def __getitem__(self,idx):
-    return np.array(self.embeddings_df.iloc[idx])
+from kmeans_engine import embedding_chunks, train_kmeans
 
 input_file = sys.argv[1]
 output_file = sys.argv[2]
-
-ds = EmbedsForKMeans(input_file)
-dl = DataLoader(ds, batch_size=10_000, shuffle=True)
-di = iter(dl)
+# Partially trained model, written every 50 steps; rerunning on the same input resumes from it
+checkpoint_file = sys.argv[3] if len(sys.argv) > 3 else output_file + ".ckpt"
 
 MAX_STEPS=500
+BATCH_SIZE=10_000
 
 km_model = MiniBatchKMeans(
     n_clusters=500,
     init="k-means++",
     max_iter=MAX_STEPS,
-    batch_size=10_000,
+    batch_size=BATCH_SIZE,
     verbose=0,
     compute_labels=False,
     tol=0.0,
@@ -44,18 +28,11 @@ km_model = MiniBatchKMeans(
     reassignment_ratio=0.0,
 )
 
-for i in tqdm(range(MAX_STEPS)):
-
-    if i >= MAX_STEPS:
-        break
-
-    try:
-        batch = next(di)
-    except StopIteration:
-        # StopIteration is thrown if dataset ends, reset for new epoch
-        di = iter(dl)
-        batch = next(di)
+# Shuffled contiguous chunks read straight from disk, so RAM stays bounded
+chunks = embedding_chunks(input_file)
+km_model = train_kmeans(chunks, km_model, MAX_STEPS, BATCH_SIZE, checkpoint_path=checkpoint_file, input_path=input_file)
 
-    km_model.partial_fit(batch)
-    
 joblib.dump(km_model, output_file)
+# Training finished, so the checkpoint is no longer needed
+if os.path.exists(checkpoint_file):
+    os.remove(checkpoint_file)
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DEBIAS_VERSION = 1
+# Group length features a model can be fit on, see load_score_table
+LENGTH_FEATURES = ("piece_counts_sum", "num_frames")
+
+class PolynomialLengthModel:
+    """Least-squares polynomial of the length feature, coefficients highest degree first."""
+
+    kind = "polynomial"
+
+    def __init__(self, degree=2, coef=None):
+        self.coef = None if coef is None else np.asarray(coef, dtype=np.float64)
+        self.degree = degree if coef is None else len(self.coef) - 1
+
+    def fit(self, x, y):
+        self.coef = np.polyfit(x, y, self.degree)
+        return self
+
+    def predict(self, x):
+        return np.polyval(self.coef, x)
+
+    def arrays(self):
+        return {"coef": self.coef}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(coef=arrays["coef"])
+
+    def __str__(self):
+        powers = ["x" if self.degree - i == 1 else f"x^{self.degree - i}" for i in range(self.degree)]
+        terms = [f"{c:.10g}{power}" for c, power in zip(self.coef[:-1], powers)]
+        return "y = " + " + ".join(terms + [f"{self.coef[-1]:.10g}"])
+
+class LinearLengthModel(PolynomialLengthModel):
+    """Least-squares line, as in corr_atds_len.py."""
+
+    kind = "linear"
+
+    def __init__(self, coef=None):
+        super().__init__(1, coef)
+
+class IsotonicLengthModel:
+    """
+    Monotone (increasing or decreasing, whichever fits better) piecewise
+    linear fit, for length effects that are not polynomial. Outside the
+    fitted range the end values are used.
+    """
+
+    kind = "isotonic"
+
+    def __init__(self, x_thresholds=None, y_thresholds=None):
+        self.x_thresholds = x_thresholds
+        self.y_thresholds = y_thresholds
+
+    def fit(self, x, y):
+        from sklearn.isotonic import IsotonicRegression
+
+        isotonic = IsotonicRegression(increasing="auto", out_of_bounds="clip").fit(x, y)
+        self.x_thresholds = isotonic.X_thresholds_
+        self.y_thresholds = isotonic.y_thresholds_
+        return self
+
+    def predict(self, x):
+        return np.interp(x, self.x_thresholds, self.y_thresholds)
+
+    def arrays(self):
+        return {"x_thresholds": self.x_thresholds, "y_thresholds": self.y_thresholds}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["x_thresholds"], arrays["y_thresholds"])
+
+    def __str__(self):
+        return f"isotonic, {len(self.x_thresholds)} knots over x in [{self.x_thresholds[0]:g}, {self.x_thresholds[-1]:g}]"
+
+# kind -> model class. A model has fit(x, y), predict(x), arrays() and from_arrays(arrays)
+LENGTH_MODELS = {model.kind: model for model in (LinearLengthModel, PolynomialLengthModel, IsotonicLengthModel)}
+
+def load_score_table(atds_csv, counts_csv=None, group_table=None):
+    """
+    ATDS of every group with the length features available: piece_counts_sum
+    from the counts CSV and the total num_frames from the group table.
+
+    Returns:
+    pd.DataFrame: atds and the features, indexed by group_id
+    """
+    from group_table import group_frames
+
+    scores_df = pd.read_csv(atds_csv, index_col=0)[["atds"]]
+    if counts_csv is not None:
+        scores_df = scores_df.join(pd.read_csv(counts_csv, index_col=0)["piece_counts_sum"])
+    if group_table is not None:
+        scores_df["num_frames"] = group_frames(group_table).reindex(scores_df.index)
+    return scores_df
+
+def score_table_sha256(scores_df, feature):
+    """sha256 of what a model is fit on: the group ids, their ATDS and the length feature."""
+    h = hashlib.sha256()
+    h.update("\n".join(str(group_id) for group_id in scores_df.index.tolist()).encode())
+    h.update(np.ascontiguousarray(scores_df[["atds", feature]].to_numpy(np.float64)).tobytes())
+    return h.hexdigest()
+
+class LengthDebiaser:
+    """
+    Expected ATDS of a group given its length, fit on a score table. ATDS
+    grows with the length of a group, so groups are compared by their ATDS
+    divided by the expected ATDS at their length. Saved as one .npz with the
+    model's arrays and a JSON header holding the model kind, its parameters,
+    the feature, the hash of the scores it was fit on and how well it fit.
+    """
+
+    def __init__(self, model, feature, meta=None):
+        self.model = model
+        self.feature = feature
+        self.meta = {"version": DEBIAS_VERSION, "kind": model.kind, "feature": feature, **(meta or {})}
+
+    @classmethod
+    def fit(cls, scores_df, feature="piece_counts_sum", kind="linear", **kwargs):
+        """
+        Fit a LENGTH_MODELS[kind](**kwargs) on the groups with a positive feature and an ATDS.
+        """
+        if feature not in LENGTH_FEATURES:
+            raise ValueError(f"feature must be one of {LENGTH_FEATURES}, got {feature}")
+        usable = scores_df[feature].gt(0) & scores_df.atds.notna()
+        x = scores_df.loc[usable, feature].to_numpy(np.float64)
+        y = scores_df.loc[usable, "atds"].to_numpy(np.float64)
+
+        model = LENGTH_MODELS[kind](**kwargs).fit(x, y)
+        r2 = 1 - np.sum((y - model.predict(x)) ** 2) / np.sum((y - y.mean()) ** 2)
+        return cls(model, feature, meta={"params": kwargs, "scores_sha256": score_table_sha256(scores_df, feature),
+                                         "num_groups": int(usable.sum()), "r2": float(r2)})
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, meta=json.dumps(self.meta), **self.model.arrays())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            if meta["version"] != DEBIAS_VERSION:
+                raise ValueError(f"{path} is length model version {meta['version']}, expected {DEBIAS_VERSION}")
+            model = LENGTH_MODELS[meta["kind"]].from_arrays(f)
+        return cls(model, meta["feature"], meta)
+
+    def expected(self, scores_df):
+        return self.model.predict(scores_df[self.feature].to_numpy(np.float64))
+
+    def debias(self, scores_df):
+        """
+        Returns:
+        pd.Series: atds / expected atds of every group, nan where the feature or the expected atds is not positive
+        """
+        expected = self.expected(scores_df)
+        usable = (scores_df[self.feature].to_numpy(np.float64) > 0) & (expected > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            debiased = np.where(usable, scores_df.atds.to_numpy(np.float64) / expected, np.nan)
+        return pd.Series(debiased, index=scores_df.index, name="atds_debiased")
+
+    def __str__(self):
+        return f"{self.model} on {self.feature} (R² = {self.meta.get('r2', float('nan')):.4f}, {self.meta.get('num_groups')} groups)"
+
+def load_or_fit_debiaser(model_path, scores_df, feature, kind, **kwargs):
+    """
+    LengthDebiaser saved at model_path if it was fit with this kind, kwargs
+    and feature on these scores (see score_table_sha256), otherwise fit it
+    on scores_df and save it there.
+    """
+    if os.path.exists(model_path):
+        debiaser = LengthDebiaser.load(model_path)
+        if (debiaser.meta["kind"] == kind and debiaser.feature == feature and debiaser.meta.get("params") == kwargs
+                and debiaser.meta.get("scores_sha256") == score_table_sha256(scores_df, feature)):
+            return debiaser
+        print(f"{model_path} was fit on other scores or settings, fitting again")
+    debiaser = LengthDebiaser.fit(scores_df, feature, kind, **kwargs)
+    debiaser.save(model_path)
+    print(f"Fit {debiaser}, saved to {model_path}")
+    return debiaser
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit length-debiasing models of ATDS and apply them to score tables')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = subparsers.add_parser('fit', help='fit a model on a score table and save it')
+    fit_parser.add_argument('--kind', default='linear', choices=list(LENGTH_MODELS))
+    fit_parser.add_argument('--degree', default=2, type=int, help='degree of the polynomial model (default=2)')
+    fit_parser.add_argument('--output', required=True, type=str, help='model .npz')
+
+    apply_parser = subparsers.add_parser('apply', help='debiased ATDS of every group of a score table')
+    apply_parser.add_argument('--model', required=True, type=str)
+    apply_parser.add_argument('--output-csv', required=True, type=str)
+
+    for sub_parser in (fit_parser, apply_parser):
+        sub_parser.add_argument('--atds-csv', required=True, type=str)
+        sub_parser.add_argument('--counts-csv', default=None, type=str, help='piece counts sums, for --feature piece_counts_sum')
+        sub_parser.add_argument('--groups', default=None, type=str, help='group table, for --feature num_frames')
+    fit_parser.add_argument('--feature', default='piece_counts_sum', choices=list(LENGTH_FEATURES))
+
+    args = parser.parse_args()
+
+    from group_table import load_group_table
+
+    scores_df = load_score_table(args.atds_csv, args.counts_csv,
+                                 load_group_table(args.groups) if args.groups is not None else None)
+    if args.command == 'fit':
+        kwargs = {"degree": args.degree} if args.kind == "polynomial" else {}
+        debiaser = LengthDebiaser.fit(scores_df, args.feature, args.kind, **kwargs)
+        debiaser.save(args.output)
+        print(f"Fit {debiaser}, saved to {args.output}")
+    else:
+        debiaser = LengthDebiaser.load(args.model)
+        scores_df["atds_debiased"] = debiaser.debias(scores_df)
+        scores_df.to_csv(args.output_csv)
+        print(f"Saved debiased ATDS of {scores_df.atds_debiased.notna().sum()} groups to {args.output_csv}")
@@ -0,0 +1,189 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sparse
+import torch
+
+from embedding_cache import file_sha256
+from lid_engine import iter_loaded_batches
+
+# Ways to turn cached utterance results into a group score, see aggregate_group_lid
+AGGREGATE_MODES = ("embedding", "posterior")
+
+class LIDCache:
+    """
+    Content-addressed on-disk cache of per-utterance language-ID results:
+    the ECAPA embedding, the log-posteriors and the number of samples the
+    classifier saw. Keyed by the sha256 of the audio bytes and a model id,
+    so an utterance is classified once no matter how many groups or
+    experiments it shows up in. Entries are .npz files under
+    cache_dir/<key[:2]>/ and are a few kB each, so there is no eviction.
+    """
+
+    def __init__(self, cache_dir, model_id):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, wav_path):
+        h = hashlib.sha256()
+        h.update(file_sha256(wav_path).encode())
+        h.update(self.model_id.encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.npz"
+
+    def get(self, key):
+        """
+        Returns:
+        tuple or None: (embedding, log_probs, num_samples)
+        """
+        try:
+            with np.load(self._path(key)) as entry:
+                result = (entry["embedding"], entry["log_probs"], int(entry["num_samples"]))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, embedding, log_probs, num_samples):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, embedding=np.asarray(embedding, dtype=np.float32),
+                     log_probs=np.asarray(log_probs, dtype=np.float32), num_samples=num_samples)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+def load_utterance(language_id, wav_path):
+    try:
+        return language_id.load_audio(wav_path)
+    except Exception as e:
+        print(f"{wav_path} の読み込みエラー: {e}")
+        return None
+
+def utterance_lid(language_id, wav_paths, num_frames, cache, **kwargs):
+    """
+    Embedding, log-posteriors and length of every utterance. Cached ones
+    are read back; the rest are run through encode_batch and the classifier
+    head in padded batches (see lid_engine.iter_loaded_batches) and cached.
+
+    Returns:
+    tuple: ((n, dim) embeddings, (n, num_classes) log-posteriors, (n,) num_samples), all zero for files that could not be loaded
+    """
+    keys = []
+    for path in wav_paths:
+        try:
+            keys.append(cache.key(path))
+        except OSError as e:
+            print(f"{path} の読み込みエラー: {e}")
+            keys.append(None)
+    results = [cache.get(key) if key is not None else None for key in keys]
+    todo = [i for i, result in enumerate(results) if result is None and keys[i] is not None]
+
+    load = lambda i: load_utterance(language_id, wav_paths[i])
+    for positions, wavs, wav_lens in iter_loaded_batches(load, todo, [num_frames[i] for i in todo], **kwargs):
+        with torch.no_grad():
+            embeddings = language_id.encode_batch(wavs, wav_lens)
+            log_probs = language_id.mods.classifier(embeddings)
+        embeddings = embeddings.reshape(len(positions), -1).float().cpu().numpy()
+        log_probs = log_probs.reshape(len(positions), -1).float().cpu().numpy()
+        lengths = (wav_lens * wavs.shape[1]).round().long().tolist()
+        for k, position in enumerate(positions):
+            i = todo[position]
+            results[i] = (embeddings[k], log_probs[k], lengths[k])
+            cache.put(keys[i], *results[i])
+
+    loaded = next((result for result in results if result is not None), None)
+    if loaded is None:
+        raise ValueError("None of the utterances could be loaded")
+    embeddings = np.zeros((len(wav_paths), len(loaded[0])), dtype=np.float32)
+    log_probs = np.zeros((len(wav_paths), len(loaded[1])), dtype=np.float32)
+    num_samples = np.zeros(len(wav_paths), dtype=np.int64)
+    for i, result in enumerate(results):
+        if result is not None:
+            embeddings[i], log_probs[i], num_samples[i] = result
+    return embeddings, log_probs, num_samples
+
+def aggregate_group_lid(language_id, membership, embeddings, log_probs, num_samples, mode, batch_size=1024):
+    """
+    Group log-posteriors composed from utterance results, without audio.
+
+    mode="embedding": the duration-weighted mean of the utterances' ECAPA
+    embeddings is fed to the classifier head. ECAPA pools frame statistics
+    over time, so this approximates classifying the concatenated audio,
+    but only roughly: the pooled standard deviations and the layers after
+    pooling do not average.
+
+    mode="posterior": log of the duration-weighted mean of the utterances'
+    posteriors, i.e. a mixture of the per-utterance decisions.
+
+    Neither mode has been shown to agree with classifying the concatenated
+    audio on the real model, so lid_posteriors defaults to concat;
+    bench_lid_aggregation.py measures the agreement of both.
+
+    Parameters:
+    membership (scipy.sparse matrix): (num_groups, num_utterances), 1 where an utterance is in a group
+
+    Returns:
+    np.ndarray: (num_groups, num_classes) float32, rows of groups without audio are nan
+    """
+    if mode not in AGGREGATE_MODES:
+        raise ValueError(f"mode must be one of {AGGREGATE_MODES}, got {mode}")
+    weights = sparse.csr_matrix(membership, dtype=np.float64) @ sparse.diags(num_samples.astype(np.float64))
+    total = np.asarray(weights.sum(axis=1)).ravel()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if mode == "posterior":
+            group_log_probs = np.log((weights @ np.exp(log_probs.astype(np.float64))) / total[:, None])
+        else:
+            group_embeddings = (weights @ embeddings.astype(np.float64)) / total[:, None]
+            group_log_probs = np.empty((len(total), log_probs.shape[1]))
+            for start in range(0, len(total), batch_size):
+                batch = torch.from_numpy(group_embeddings[start:start + batch_size]).float()
+                with torch.no_grad():
+                    out = language_id.mods.classifier(batch[:, None, :].to(language_id.device))
+                group_log_probs[start:start + batch_size] = out.reshape(len(batch), -1).float().cpu().numpy()
+
+    group_log_probs[total == 0] = np.nan
+    return group_log_probs.astype(np.float32)
+
+def cached_group_log_probs(language_id, groups, base_dir, cache, num_frames=None, *, mode, **kwargs):
+    """
+    Group log-posteriors from the per-utterance cache: every distinct file
+    of the groups is classified at most once (and not at all if cached),
+    then the groups are composed with aggregate_group_lid in the given mode.
+
+    Parameters:
+    groups (dict): group id -> list of file names in base_dir
+    num_frames (dict): optional. file name -> audio samples, to bucket the uncached files by length
+        (default: estimated from the size of 16-bit wav files)
+
+    Returns:
+    np.ndarray: (num_groups, num_classes) float32 in the order of groups
+    """
+    files = list(dict.fromkeys(f for filenames in groups.values() for f in filenames))
+    file_index = {f: i for i, f in enumerate(files)}
+    if num_frames is None:
+        paths = [os.path.join(base_dir, f) for f in files]
+        lengths = [os.path.getsize(path) // 2 if os.path.exists(path) else 0 for path in paths]
+    else:
+        lengths = [num_frames[f] for f in files]
+
+    embeddings, log_probs, num_samples = utterance_lid(language_id, [os.path.join(base_dir, f) for f in files],
+                                                       lengths, cache, **kwargs)
+
+    rows = np.repeat(np.arange(len(groups)), [len(filenames) for filenames in groups.values()])
+    cols = np.fromiter((file_index[f] for filenames in groups.values() for f in filenames), dtype=np.int64, count=len(rows))
+    membership = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(groups), len(files)))
+    return aggregate_group_lid(language_id, membership, embeddings, log_probs, num_samples, mode=mode)
@@ -0,0 +1,120 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+import torch
+
+from embedding_engine import make_batches
+
+# Padded audio samples (16 kHz) per classify_batch call, about 28 groups of 21 sec
+MAX_LID_BATCH_FRAMES = 16_000 * 600
+# Batches whose audio is loaded ahead of the one being classified
+PREFETCH_BATCHES = 2
+# Hop of the classifier's Fbank (10 ms at 16 kHz). A zero-padded signal scores exactly as on its own only
+# while the padding adds no Fbank frame; beyond that the padded edge frames shift its log-posteriors
+FBANK_HOP_SAMPLES = 160
+
+def load_group_signal(language_id, base_dir, filenames):
+    """
+    All files of a group joined into one signal, as SB_v3.py did, but with
+    a single concatenation. Files that fail to load are reported and skipped.
+
+    Returns:
+    torch.Tensor or None: (num_samples,) signal, None if no file could be loaded
+    """
+    signals = []
+    for filename in filenames:
+        file_path = os.path.join(base_dir, filename)
+        try:
+            signals.append(language_id.load_audio(file_path))
+        except Exception as e:
+            print(f"{file_path} の読み込みエラー: {e}")
+    return torch.cat(signals, dim=-1) if signals else None
+
+def collate_signals(signals):
+    """
+    Zero-pad signals into a (B, T) batch.
+
+    Returns:
+    tuple: (wavs, wav_lens as fractions of T, the relative lengths EncoderClassifier expects)
+    """
+    lengths = torch.tensor([signal.shape[-1] for signal in signals])
+    wavs = torch.zeros(len(signals), int(lengths.max()))
+    for i, signal in enumerate(signals):
+        wavs[i, :lengths[i]] = signal
+    return wavs, lengths / lengths.max()
+
+def iter_loaded_batches(load, items, num_frames, max_batch_frames=MAX_LID_BATCH_FRAMES, bucket_size=FBANK_HOP_SAMPLES,
+                        num_workers=8, prefetch_batches=PREFETCH_BATCHES):
+    """
+    Length-bucketed batches of signals, load(item) being run in a thread
+    pool for the next prefetch_batches batches while the caller works on
+    the current one. Only signals with the same length // bucket_size are
+    padded into one batch, judged on the loaded signals since num_frames
+    may be off; the default keeps every signal's scores as if classified
+    alone. bucket_size=None pads any lengths together.
+
+    Yields:
+    tuple: (positions in items, (B, T) padded wavs, (B,) relative wav_lens), items whose load returned None left out
+    """
+    batches = make_batches(num_frames, max_batch_frames, bucket_size)
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        def submit(batch):
+            return [pool.submit(load, items[i]) for i in batch]
+
+        pending = deque(submit(batch) for batch in batches[:prefetch_batches])
+        for batch_idx, batch in enumerate(batches):
+            signals = [future.result() for future in pending.popleft()]
+            if batch_idx + prefetch_batches < len(batches):
+                pending.append(submit(batches[batch_idx + prefetch_batches]))
+
+            buckets = {}
+            for k, signal in enumerate(signals):
+                if signal is not None:
+                    buckets.setdefault(0 if bucket_size is None else signal.shape[-1] // bucket_size, []).append(k)
+            for loaded in buckets.values():
+                wavs, wav_lens = collate_signals([signals[k] for k in loaded])
+                yield [batch[k] for k in loaded], wavs, wav_lens
+
+def iter_lid_batches(language_id, groups, base_dir, num_frames, **kwargs):
+    """
+    Classify groups of files with a SpeechBrain EncoderClassifier, many
+    groups per classify_batch call. Only groups with the same number of
+    Fbank frames share a batch (see iter_loaded_batches), so the padding
+    left out through wav_lens stays within one hop and each group scores
+    as if classified alone. The audio of the next batches is loaded in a
+    thread pool while the current one is classified.
+
+    Parameters:
+    groups (dict): group id -> list of file names in base_dir
+    num_frames (array-like): total audio samples of each group, in the order of groups
+
+    Yields:
+    tuple: (group ids of the batch, (len, num_classes) float32 log-posteriors), groups without audio left out
+    """
+    group_ids = list(groups)
+    load = lambda group_id: load_group_signal(language_id, base_dir, groups[group_id])
+
+    for positions, wavs, wav_lens in iter_loaded_batches(load, group_ids, num_frames, **kwargs):
+        with torch.no_grad():
+            log_probs = language_id.classify_batch(wavs, wav_lens)[0]
+        yield [group_ids[i] for i in positions], log_probs.reshape(len(positions), -1).float().cpu().numpy()
+
+def lid_log_probs(language_id, groups, base_dir, num_frames, **kwargs):
+    """
+    Log-posteriors of every group, in the order of groups (see iter_lid_batches).
+
+    Returns:
+    np.ndarray: (num_groups, num_classes) float32, rows of groups without audio are nan
+    """
+    position = {group_id: i for i, group_id in enumerate(groups)}
+    log_probs = None
+    for batch_group_ids, batch_log_probs in iter_lid_batches(language_id, groups, base_dir, num_frames, **kwargs):
+        if log_probs is None:
+            log_probs = np.full((len(groups), batch_log_probs.shape[1]), np.nan, dtype=np.float32)
+        log_probs[[position[group_id] for group_id in batch_group_ids]] = batch_log_probs
+    if log_probs is None:
+        raise ValueError("None of the groups had any audio that could be loaded")
+    return log_probs
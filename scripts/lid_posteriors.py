@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from embedding_cache import file_sha256
+
+LID_VERSION = 1
+LID_SOURCE = "speechbrain/lang-id-voxlingua107-ecapa"
+# How group log-posteriors are obtained: classifying each group's concatenated audio, or composing
+# cached per-utterance results (lid_cache.AGGREGATE_MODES). Composing is not the default until
+# bench_lid_aggregation.py has measured its agreement with concat on the real model
+LID_AGGREGATES = ("concat", "embedding", "posterior")
+
+def load_language_id(device=None, source=LID_SOURCE, savedir="tmp"):
+    """SpeechBrain language-ID classifier, on CUDA when available unless a device is given."""
+    import torch
+    from speechbrain.inference.classifiers import EncoderClassifier
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    return EncoderClassifier.from_hparams(source=source, savedir=savedir, run_opts={"device": device})
+
+def classifier_labels(language_id):
+    """All class labels of the classifier in output order, e.g. "pa: Panjabi"."""
+    import torch
+    label_encoder = language_id.hparams.label_encoder
+    return list(label_encoder.decode_ndim(torch.arange(len(label_encoder))))
+
+def score_lid_posteriors(language_id, groups_path, base_dir, output_path, cache_dir=None, aggregate="concat", **kwargs):
+    """
+    One language-ID pass over every group of a group table, saving the full
+    log-posterior vector of each group (see LIDPosteriors).
+
+    With aggregate="concat" every group's concatenated audio is classified.
+    The other aggregates compose groups from per-utterance results kept in
+    a LIDCache in cache_dir (see lid_cache.aggregate_group_lid for the
+    modes), so utterances shared with earlier runs or other groupings are
+    not re-run.
+    """
+    from group_table import load_group_table, grouped_paths, group_frames
+
+    if aggregate not in LID_AGGREGATES:
+        raise ValueError(f"aggregate must be one of {LID_AGGREGATES}, got {aggregate}")
+    if aggregate != "concat" and cache_dir is None:
+        raise ValueError(f"aggregate={aggregate} composes cached utterances and needs a cache_dir")
+
+    group_table = load_group_table(groups_path)
+    groups = grouped_paths(group_table)
+    if aggregate == "concat":
+        from lid_engine import lid_log_probs
+        log_probs = lid_log_probs(language_id, groups, base_dir, group_frames(group_table).to_numpy(), **kwargs)
+    else:
+        from lid_cache import LIDCache, cached_group_log_probs
+        cache = LIDCache(cache_dir, LID_SOURCE)
+        file_frames = dict(zip(group_table.path, group_table.num_frames))
+        log_probs = cached_group_log_probs(language_id, groups, base_dir, cache, file_frames, mode=aggregate, **kwargs)
+        print(f"LID cache: {cache.stats()}")
+
+    save_lid_posteriors(output_path, list(groups), log_probs, classifier_labels(language_id),
+                        source=LID_SOURCE, groups_path=groups_path, groups_sha256=file_sha256(groups_path),
+                        base_dir=base_dir, aggregate=aggregate)
+    return LIDPosteriors(output_path)
+
+def save_lid_posteriors(path, group_ids, log_probs, labels, **meta):
+    meta = {"version": LID_VERSION, **meta}
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, meta=json.dumps(meta), group_ids=np.asarray(group_ids),
+             log_probs=np.asarray(log_probs, dtype=np.float16), labels=np.asarray(labels))
+    os.replace(tmp_path, path)
+
+class LIDPosteriors:
+    """
+    Language-ID log-posteriors of every group, (num_groups, num_classes)
+    float16 in one .npz with the group ids, class labels and a JSON header.
+    Probability, rank and top-k of any language are derived from it without
+    running the classifier again. Groups without audio are nan rows.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as f:
+            self.meta = json.loads(str(f["meta"]))
+            if self.meta["version"] != LID_VERSION:
+                raise ValueError(f"{path} is LID posteriors version {self.meta['version']}, expected {LID_VERSION}")
+            self.group_ids = f["group_ids"]
+            self.log_probs = f["log_probs"]
+            self.labels = f["labels"].tolist()
+        self.path = path
+
+    def matches(self, groups_path, base_dir, aggregate):
+        """
+        True if the posteriors were scored from this group table (by content,
+        not by path), audio directory and aggregation, and cover exactly the
+        table's groups in its order.
+        """
+        from group_table import load_group_table, grouped_paths
+
+        if (self.meta.get("groups_sha256") != file_sha256(groups_path) or self.meta.get("base_dir") != base_dir
+                or self.meta.get("aggregate") != aggregate):
+            return False
+        group_ids = list(grouped_paths(load_group_table(groups_path)))
+        return [str(group_id) for group_id in self.group_ids.tolist()] == [str(group_id) for group_id in group_ids]
+
+    def label_index(self, label):
+        """Column of a label, given in full ("pa: Panjabi") or as its language code ("pa")."""
+        if label in self.labels:
+            return self.labels.index(label)
+        codes = [full_label.split(":")[0] for full_label in self.labels]
+        if label in codes:
+            return codes.index(label)
+        raise ValueError(f"{label} is not a label of the classifier")
+
+    def log_prob(self, label):
+        return self.log_probs[:, self.label_index(label)].astype(np.float64)
+
+    def prob(self, label):
+        """Posterior probability of label per group (SB_v3.py's score)."""
+        return np.exp(self.log_prob(label))
+
+    def rank(self, label):
+        """
+        1 + number of languages scored above label per group (SB_rank.py's
+        score), as float with nan for groups without audio. Languages that
+        round to the same float16 score count as tied, which can move ranks
+        deep in the tail by one or two.
+        """
+        column = self.log_probs[:, [self.label_index(label)]]
+        ranks = (self.log_probs > column).sum(axis=1) + 1.0
+        ranks[np.isnan(column[:, 0])] = np.nan
+        return ranks
+
+    def top_k(self, k=5):
+        """
+        Returns:
+        pd.DataFrame: label and probability of the k most likely languages per group, indexed by group_id
+        """
+        log_probs = np.nan_to_num(self.log_probs.astype(np.float32), nan=-np.inf)
+        top = np.argpartition(-log_probs, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(log_probs, top, axis=1), axis=1), axis=1)
+        labels = np.asarray(self.labels)
+        no_audio = np.isnan(self.log_probs[:, 0])
+        top_df = pd.DataFrame(index=pd.Index(self.group_ids, name="group_id"))
+        for i in range(k):
+            top_df[f"label_{i + 1}"] = np.where(no_audio, None, labels[top[:, i]])
+            top_df[f"prob_{i + 1}"] = np.exp(np.take_along_axis(log_probs, top[:, [i]], axis=1)[:, 0])
+        return top_df
+
+    def scores(self, label):
+        """
+        Returns:
+        pd.DataFrame: SB (probability) and rank of label per group, indexed by group_id
+        """
+        return pd.DataFrame({"SB": self.prob(label), "rank": self.rank(label)},
+                            index=pd.Index(self.group_ids, name="group_id"))
+
+def load_or_score_lid_posteriors(posteriors_path, groups_path, base_dir, **kwargs):
+    """
+    LIDPosteriors of a group table, running the classifier only if none were
+    saved for this table, audio directory and aggregation (see matches).
+    kwargs go to score_lid_posteriors.
+    """
+    aggregate = kwargs.get("aggregate", "concat")
+    if os.path.exists(posteriors_path):
+        posteriors = LIDPosteriors(posteriors_path)
+        if posteriors.matches(groups_path, base_dir, aggregate):
+            return posteriors
+        print(f"{posteriors_path} was scored from another group table or setting, scoring again")
+    return score_lid_posteriors(load_language_id(), groups_path, base_dir, posteriors_path, **kwargs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Language-ID log-posteriors of every group in one pass, and scores derived from them')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    score_parser = subparsers.add_parser('score', help='run the classifier once over all groups')
+    score_parser.add_argument('--groups', required=True, type=str, help='group table')
+    score_parser.add_argument('--base-dir', required=True, type=str)
+    score_parser.add_argument('--output', required=True, type=str, help='posteriors .npz')
+    score_parser.add_argument('--device', default=None, type=str)
+    score_parser.add_argument('--utterance-cache', default=None, type=str,
+                help='per-utterance results are cached in this directory, for --aggregate embedding or posterior')
+    score_parser.add_argument('--aggregate', default='concat', choices=list(LID_AGGREGATES),
+                help='classify each group\'s concatenated audio, or compose it from cached utterances (default=concat)')
+
+    derive_parser = subparsers.add_parser('derive', help='probability, rank and top-k of a target language')
+    derive_parser.add_argument('--posteriors', required=True, type=str)
+    derive_parser.add_argument('--target', default='pa: Panjabi', type=str, help='label or language code (default: pa: Panjabi)')
+    derive_parser.add_argument('--top-k', default=0, type=int, help='optional. Also write the k most likely languages')
+    derive_parser.add_argument('--output-csv', required=True, type=str)
+
+    args = parser.parse_args()
+    if args.command == 'score':
+        posteriors = score_lid_posteriors(load_language_id(args.device), args.groups, args.base_dir, args.output,
+                                          cache_dir=args.utterance_cache, aggregate=args.aggregate)
+        print(f"Saved {posteriors.log_probs.shape} log-posteriors to {args.output}")
+    else:
+        posteriors = LIDPosteriors(args.posteriors)
+        scores_df = posteriors.scores(args.target)
+        if args.top_k:
+            scores_df = scores_df.join(posteriors.top_k(args.top_k))
+        scores_df.to_csv(args.output_csv)
+        print(f"Saved {args.target} scores of {len(scores_df)} groups to {args.output_csv}")
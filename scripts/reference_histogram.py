@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+
+import numpy as np
+import sentencepiece as spm
+
+from atds_pipeline import reference_histogram_from_clusters
+from embedding_cache import file_sha256
+
+REFERENCE_VERSION = 1
+
+class ReferenceHistogram:
+    """
+    Precomputed piece histogram of the reference (target) language, saved as
+    one .npz with the nonzero piece ids, their counts and a JSON header
+    holding the format version, the language and the sha256 of the
+    SentencePiece model and k-means model the counts were made with.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as f:
+            self.meta = json.loads(str(f["meta"]))
+            if self.meta["version"] != REFERENCE_VERSION:
+                raise ValueError(f"{path} is reference histogram version {self.meta['version']}, expected {REFERENCE_VERSION}")
+            self.histogram = np.zeros(self.meta["vocab_size"], dtype=np.int64)
+            self.histogram[f["piece_ids"]] = f["counts"]
+        self.path = path
+
+    def matches(self, spm_model_file, km_model_file):
+        """True if the histogram was built with these SentencePiece and k-means models."""
+        return (self.meta["spm_sha256"] == file_sha256(spm_model_file)
+                and self.meta["kmeans_sha256"] == file_sha256(km_model_file))
+
+def build_reference_histogram(clustered_parquet, spm_model_file, km_model_file, output_path, lang=None):
+    """
+    Encode the reference language's clustered parquet (wav_file, cluster_id)
+    with the SentencePiece model and save its piece counts.
+    """
+    sp = spm.SentencePieceProcessor(model_file=spm_model_file)
+    histogram = reference_histogram_from_clusters(clustered_parquet, sp)
+    piece_ids = np.flatnonzero(histogram)
+    meta = {
+        "version": REFERENCE_VERSION,
+        "lang": lang,
+        "clustered_parquet": os.path.abspath(clustered_parquet),
+        "spm_sha256": file_sha256(spm_model_file),
+        "kmeans_sha256": file_sha256(km_model_file),
+        "vocab_size": sp.get_piece_size(),
+        "num_pieces": int(histogram.sum()),
+    }
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, meta=json.dumps(meta), piece_ids=piece_ids, counts=histogram[piece_ids])
+    os.replace(tmp_path, output_path)
+    return ReferenceHistogram(output_path)
+
+def load_reference_histogram(path, clustered_parquet, spm_model_file, km_model_file, lang=None):
+    """Load the reference histogram at path, rebuilding it if missing or made with other models."""
+    if os.path.exists(path):
+        try:
+            reference = ReferenceHistogram(path)
+        except ValueError as e:
+            print(f"{e}, rebuilding")
+        else:
+            if reference.matches(spm_model_file, km_model_file):
+                return reference
+            print(f"{path} was built with another SentencePiece or k-means model, rebuilding")
+    return build_reference_histogram(clustered_parquet, spm_model_file, km_model_file, path, lang=lang)
+
+if __name__ == "__main__":
+    # python reference_histogram.py <lang>_clustered.parquet <spm.model> <k-means.joblib> <output.npz> [lang]
+    reference = build_reference_histogram(*sys.argv[1:5], lang=sys.argv[5] if len(sys.argv) > 5 else None)
+    print(f"Saved {reference.meta['num_pieces']} pieces of {reference.meta['lang']} to {sys.argv[4]}")
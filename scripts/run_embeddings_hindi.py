@@ -1,24 +1,17 @@
-import subprocess
+import time
 
-def run_command(command):
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-    if process.returncode != 0:
-        print(f"Error executing command: {command}")
-        print(f"Error message: {stderr.decode('utf-8')}")
-    else:
-        print(f"Command executed successfully: {command}")
+from corpus_atds import pool_df
+from cluster_jobs import ClusterJobRunner, random_subset_jobs
 
-# 1000回の繰り返しを行います
-for i in range(1000):
-    # 埋め込みを抽出します
-    extract_command = f"python scripts/extract_embeddings.py --checkpoint-path checkpoints/xlsr2_300m.pt --wav-dir data/IndicSUPERB/kb_data_clean_m4a/hindi/train/audio --num-hours 0.5 --output-parquet tmp/hindi{i}_.parquet"
-    run_command(extract_command)
+# 1000個の0.5時間サブセットを、モデルを一度だけ読み込んで埋め込み抽出とK-means推論します
+wav_dir = "data/IndicSUPERB/kb_data_clean_m4a/hindi/train/audio"
+seed = int(time.time())
+print(f"Random subsets with seeds {seed}..{seed + 999}")
 
-    # K-means推論を実行します
-    infer_command = f"python scripts/infer_k-means.py tmp/k-means_punjabi.joblib tmp/hindi{i}_.parquet tmp/hindi-clustered{i}_.parquet"
-    run_command(infer_command)
+jobs = random_subset_jobs(pool_df(wav_dir), 0.5, 1000, "tmp/hindi-clustered{}_.parquet", seed)
+runner = ClusterJobRunner("checkpoints/xlsr2_300m.pt", "tmp/k-means_punjabi.joblib", wav_dir,
+                          cache_dir="tmp/embedding_cache")
+latency_df = runner.run(jobs)
+latency_df.to_csv("tmp/hindi-clustered_latency.csv", index=False)
 
-    print(f"Completed iteration {i+1} of 1000")
-
-print("All iterations completed.")
\ No newline at end of file
+print("All iterations completed.")
@@ -1,7 +1,7 @@
 import os
 import sys
-import csv
 from extract_embeddings import get_multiple_data_df
+from group_table import make_group_table, save_group_table
 
 def check_directory(path):
     print(f"Checking directory: {path}")
@@ -61,15 +61,15 @@ try:
             # 保存先ディレクトリの確認と作成
             output_dir = "/work/result"
             if check_directory(output_dir):
-                output_file = os.path.join(output_dir, "punjabi_10h_pretrain_3.csv")
+                output_file = os.path.join(output_dir, "punjabi_10h_pretrain_3.parquet")
                 try:
-                    # DataFrameを直接CSVとして保存
-                    result[0].to_csv(output_file, index=True)
+                    # (group_id, path, num_frames) のparquetとして保存
+                    save_group_table(make_group_table(result), output_file)
                     print(f"\nData has been saved to {output_file}")
                     print(f"File exists: {os.path.exists(output_file)}")
                     print(f"File size: {os.path.getsize(output_file)} bytes")
                 except Exception as save_error:
-                    print(f"Error saving CSV file: {str(save_error)}")
+                    print(f"Error saving group table: {str(save_error)}")
             else:
                 print("Failed to create or access the output directory.")
     else:
@@ -83,4 +83,4 @@ except Exception as e:
 
 print("\nScript execution completed.")
 print(f"Final check - Output directory exists: {os.path.exists('/work/result')}")
-print(f"Final check - Output file exists: {os.path.exists('/work/result/punjabi_10h_pretrain_3.csv')}")
\ No newline at end of file
+print(f"Final check - Output file exists: {os.path.exists('/work/result/punjabi_10h_pretrain_3.parquet')}")
\ No newline at end of file
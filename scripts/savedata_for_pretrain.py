@@ -1,39 +1,9 @@
-import pandas as pd
 import os
 import shutil
 import argparse
 from pathlib import Path
 
-def extract_paths_from_data(data_str):
-    """Extract file paths from the string representation of DataFrames"""
-    try:
-        # Split the data into chunks (each chunk contains one DataFrame)
-        chunks = data_str.split('","')
-        
-        # Process each chunk
-        all_paths = []
-        for chunk in chunks:
-            # Clean up the chunk
-            chunk = chunk.strip('"\n').strip()
-            if not chunk:
-                continue
-                
-            # Find lines containing path and num_frames
-            lines = chunk.split('\n')
-            for line in lines:
-                if '.wav' in line:
-                    # Extract the wav file path
-                    parts = line.split()
-                    # Find the part that ends with .wav
-                    for part in parts:
-                        if part.endswith('.wav'):
-                            all_paths.append(part.strip())
-                            break
-        
-        return all_paths
-    except Exception as e:
-        print(f"Error parsing data: {str(e)}")
-        return []
+from group_table import load_group_table
 
 def copy_audio_files(file_paths, source_dir, target_dir):
     """Copy audio files from source directory to target directory"""
@@ -77,13 +47,13 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Example usage:
-  python savedata_for_pretrain.py --input data.csv --source /path/to/source --target /path/to/target
+  python savedata_for_pretrain.py --input groups.parquet --source /path/to/source --target /path/to/target
         """
     )
     
     # Add arguments
     parser.add_argument('--input', '-i', required=True,
-                      help='Path to the input file containing file paths')
+                      help='Path to the group table (group_id, path, num_frames) containing file paths')
     parser.add_argument('--source', '-s',
                       default="/workspace/data/IndicSUPERB/kb_data_clean_m4a/hindi/train/audio",
                       help='Source directory containing the audio files')
@@ -104,17 +74,13 @@ Example usage:
         print(f"Error: Source directory '{args.source}' does not exist.")
         return
     
-    # Get the string data from your DataFrame
+    # Get the file paths of every group
     try:
-        with open(args.input, 'r') as f:
-            data_str = f.read()
+        file_paths = load_group_table(args.input)['path'].tolist()
     except Exception as e:
         print(f"Error reading input file: {str(e)}")
         return
     
-    # Extract file paths
-    file_paths = extract_paths_from_data(data_str)
-    
     # Remove any whitespace from file paths
     file_paths = [path.strip() for path in file_paths if path.strip()]
     
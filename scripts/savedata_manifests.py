@@ -1,24 +1,15 @@
 # デバッグ機能マシマシのまま
 
-import pandas as pd
 import argparse
 import os
-import io
+
+from group_table import load_group_table
 
 def read_input_data(input_file):
-    """Read input CSV file and parse the DataFrame string representation"""
+    """Read the group table and list the (path, num_frames) of every file in it"""
     try:
-        # CSVファイルを読み込む
-        raw_data = pd.read_csv(input_file)
-        
-        all_entries = []
-        # 'data'列の各行を処理
-        for df_str in raw_data['data']:
-            # 文字列をDataFrameに変換
-            # StringIOを使用してテキストをDataFrameとして読み込む
-            df = pd.read_csv(io.StringIO(df_str), delim_whitespace=True)
-            if not df.empty:
-                all_entries.extend(zip(df['path'], df['num_frames']))
+        group_table = load_group_table(input_file)
+        all_entries = list(zip(group_table['path'], group_table['num_frames']))
         
         print(f"Parsed {len(all_entries)} entries from input file")
         if len(all_entries) > 0:
@@ -30,30 +21,7 @@ def read_input_data(input_file):
         
     except Exception as e:
         print(f"Error reading input file: {str(e)}")
-        print("Attempting alternative parsing method...")
-        try:
-            # 別の解析方法を試す
-            df_str = raw_data['data'].iloc[0]
-            lines = df_str.split('\n')
-            entries = []
-            for line in lines[1:]:  # ヘッダーをスキップ
-                parts = line.strip().split()
-                if len(parts) >= 2 and parts[0].endswith('.wav'):
-                    wav_file = parts[0]
-                    num_frames = int(parts[-1])
-                    entries.append((wav_file, num_frames))
-            
-            print(f"Parsed {len(entries)} entries using alternative method")
-            if len(entries) > 0:
-                print("Sample entries:")
-                for entry in entries[:3]:
-                    print(f"{entry[0]}\t{entry[1]}")
-            
-            return entries
-            
-        except Exception as e2:
-            print(f"Alternative parsing also failed: {str(e2)}")
-            return None
+        return None
 
 def save_manifest(file_info, output_file):
     """Save manifest to a TSV file"""
@@ -82,11 +50,11 @@ def save_manifest(file_info, output_file):
         return False
 def main():
     parser = argparse.ArgumentParser(
-        description='Create manifest file from DataFrame containing audio file information.'
+        description='Create manifest file from a group table containing audio file information.'
     )
     
     parser.add_argument('--input', '-i', required=True,
-                      help='Input CSV file path containing audio file information')
+                      help='Input group table path (group_id, path, num_frames) containing audio file information')
     parser.add_argument('--output', '-o', required=True,
                       help='Output manifest file path')
     parser.add_argument('--debug', action='store_true',
@@ -103,9 +71,8 @@ def main():
     
     # 入力ファイルの最初の数行を表示
     if args.debug:
-        print("\nFirst few lines of input file:")
-        with open(args.input, 'r') as f:
-            print(f.read(500))
+        print("\nFirst few rows of input file:")
+        print(load_group_table(args.input).head())
     
     # データの読み込み
     entries = read_input_data(args.input)
@@ -56,79 +56,37 @@
 #     with open('/work/data/manifests/pretrain/hindi_train_18sec6000_filterto3000_random.tsv', 'w', encoding='utf-8') as f:
 #         f.write(formatted_wavfiles)
 
-import pandas as pd
 import random
 
+from group_selection import top_k, write_manifest
+from group_table import load_group_table, group_rows
+from length_debias import load_score_table, load_or_fit_debiaser
+
 def sort_atds(random_shuffle=False):
-    # ATDSスコアの読み込み
-    df = pd.read_csv("/work/result/ATDS_hindi_21_20000_3.csv")
-    d = df.to_dict()
-    ATDS_dict = d["atds"]
+    # グループ表の読み込み
+    group_table = load_group_table("/work/result/hindi_21sec_20000_train_3.parquet")
+    # ATDSスコアとグループごとのフレーム数の合計
+    scores_df = load_score_table("/work/result/ATDS_hindi_21_20000_3.csv", group_table=group_table)
     
-    # 音声ファイル情報の読み込み
-    wavfile_dict = pd.read_csv("/work/result/hindi_21sec_20000_train_3.csv").to_dict()["data"]
-    # フレーム数の合計を計算
-    frame_sums = {}
-    for idx, wav_info in wavfile_dict.items():
-        # 各行を処理
-        rows = wav_info.strip().split('\n')
-        total_frames = 0
-        for row in rows[1:]:  # ヘッダー行をスキップ
-            if row.strip():  # 空行でない場合
-                parts = row.strip().split()
-                # 最後の要素をフレーム数として取得
-                frames = int(parts[-1])
-                total_frames += frames
-        frame_sums[idx] = total_frames
+    # フレーム数に対するATDSの線形回帰（保存済みなら読み込み、なければスコアから当てはめて保存）
+    debiaser = load_or_fit_debiaser("/work/result/length_model_hindi_21_20000_3.npz", scores_df,
+                                    feature="num_frames", kind="linear")
+    print(debiaser)
     
-    # ATDSの正規化
-    normalized_atds = {}
-    for idx, atds in ATDS_dict.items():
-        if idx in frame_sums and frame_sums[idx] > 0:
-            y = 0.005311*frame_sums[idx] + 0.5626
-            print(frame_sums[idx])
-            print(y)
-            normalized_atds[idx] = atds / y
-            print(normalized_atds[idx])
+    # ATDSの正規化（フレーム数のあるグループのみ）
+    normalized_atds = debiaser.debias(scores_df).dropna()
+    print(normalized_atds.describe())
     
-    # 正規化されたATDSでソート
-    ATDS_sorted_list = sorted(normalized_atds.items(), key=lambda x: x[1], reverse=True)
-    print(ATDS_sorted_list)
+    # 正規化されたATDSが高い順に上位???件を選択
     if random_shuffle:
-        random.shuffle(ATDS_sorted_list)
-    
-    # 上位???件を選択
-    ATDS_filtered_list = ATDS_sorted_list[:18000]
-    num_group = [tup[0] for tup in ATDS_filtered_list]
+        num_group = random.sample(list(normalized_atds.index), min(18000, len(normalized_atds)))
+    else:
+        num_group = top_k(normalized_atds, 18000)
     
     # 選択されたファイル情報を取得
-    finaldf = []
-    for num in num_group:
-        finaldf.append(wavfile_dict[num])
-    return finaldf
-
-def format_wav_list(data_list):
-    formatted_rows = []
-    
-    for line in data_list:
-        # DataFrameの形式で書かれたテキストを行ごとに分割
-        rows = line.strip().split('\n')
-        for row in rows[1:]:  # ヘッダー行をスキップ
-            if row.strip():  # 空行でない場合
-                # 行をスペースで分割して必要な情報を抽出
-                parts = row.strip().split()
-                # 最後の要素がフレーム数、その直前がパス
-                filename = parts[-2].strip(',"')
-                num_frames = parts[-1].strip()
-                formatted_row = f"{filename}\t{num_frames}"
-                if formatted_row not in formatted_rows:
-                    formatted_rows.append(formatted_row)
-    
-    return '\n'.join(formatted_rows)
+    return group_rows(group_table, num_group)
 
 if __name__ == "__main__":
-    data_list = sort_atds(False)  # True for random shuffle
-    formatted_wavfiles = format_wav_list(data_list)
-    with open('/work/data/manifests/pretrain/hindi_train_21sec20000_filterto18000_atds_3.tsv', 'w', encoding='utf-8') as f:
-        f.write(formatted_wavfiles)
+    data_rows = sort_atds(False)  # True for random shuffle
+    write_manifest(data_rows, '/work/data/manifests/pretrain/hindi_train_21sec20000_filterto18000_atds_3.tsv')
 
@@ -56,70 +56,38 @@
 #     with open('/work/data/manifests/pretrain/hindi_train_18sec6000_filterto3000_random.tsv', 'w', encoding='utf-8') as f:
 #         f.write(formatted_wavfiles)
 
-import pandas as pd
 import random
 
+from group_selection import top_k, write_manifest
+from group_table import load_group_table, group_rows
+from length_debias import load_score_table, load_or_fit_debiaser
+
 def sort_atds(random_shuffle=False):
-    # ATDSスコアの読み込み
-    df = pd.read_csv("/work/result/ATDS_hindi_21sec_20000.csv")
-    d = df.to_dict()
-    ATDS_dict = d["atds"]
-    #token数の合計値取得
-    df2 = pd.read_csv("/work/result/piece_counts_sums_hindi_21sec_20000.csv")
-    d2 = df2.to_dict()
-    token_dict = d2["piece_counts_sum"]
-    # 音声ファイル情報の読み込み
-    wavfile_dict = pd.read_csv("/work/result/hindi_21sec_20000_train.csv").to_dict()["data"]
+    # ATDSスコアとtoken数の合計値
+    scores_df = load_score_table("/work/result/ATDS_hindi_21sec_20000.csv",
+                                 counts_csv="/work/result/piece_counts_sums_hindi_21sec_20000.csv")
+    # グループ表の読み込み
+    group_table = load_group_table("/work/result/hindi_21sec_20000_train.parquet")
+
+    # token数に対するATDSの2次回帰（保存済みなら読み込み、なければスコアから当てはめて保存）
+    debiaser = load_or_fit_debiaser("/work/result/token_model_hindi_21sec_20000.npz", scores_df,
+                                    feature="piece_counts_sum", kind="polynomial", degree=2)
+    print(debiaser)
 
-    # ATDSの正規化
-    normalized_atds = {}
-    for idx, atds in ATDS_dict.items():
-        if idx in token_dict and token_dict[idx] > 0:
-            x = token_dict[idx]
-            y = -0.0000007272*x*x + 0.00109283*x + 0.23890562
-            print(token_dict[idx])
-            print(y)
-            normalized_atds[idx] = atds / y
-            print(normalized_atds[idx])
+    # ATDSの正規化（token数があり、予測値が正のグループのみ）
+    normalized_atds = debiaser.debias(scores_df).dropna()
+    print(normalized_atds.describe())
     
-    # 正規化されたATDSでソート
-    ATDS_sorted_list = sorted(normalized_atds.items(), key=lambda x: x[1], reverse=False)
-    print(ATDS_sorted_list)
+    # 正規化されたATDSが低い順に上位???件を選択
     if random_shuffle:
-        random.shuffle(ATDS_sorted_list)
-    
-    # 上位???件を選択
-    ATDS_filtered_list = ATDS_sorted_list[:4000]
-    num_group = [tup[0] for tup in ATDS_filtered_list]
+        num_group = random.sample(list(normalized_atds.index), min(4000, len(normalized_atds)))
+    else:
+        num_group = top_k(normalized_atds, 4000, ascending=True)
     
     # 選択されたファイル情報を取得
-    finaldf = []
-    for num in num_group:
-        finaldf.append(wavfile_dict[num])
-    return finaldf
-
-def format_wav_list(data_list):
-    formatted_rows = []
-    
-    for line in data_list:
-        # DataFrameの形式で書かれたテキストを行ごとに分割
-        rows = line.strip().split('\n')
-        for row in rows[1:]:  # ヘッダー行をスキップ
-            if row.strip():  # 空行でない場合
-                # 行をスペースで分割して必要な情報を抽出
-                parts = row.strip().split()
-                # 最後の要素がフレーム数、その直前がパス
-                filename = parts[-2].strip(',"')
-                num_frames = parts[-1].strip()
-                formatted_row = f"{filename}\t{num_frames}"
-                if formatted_row not in formatted_rows:
-                    formatted_rows.append(formatted_row)
-    
-    return '\n'.join(formatted_rows)
+    return group_rows(group_table, num_group)
 
 if __name__ == "__main__":
-    data_list = sort_atds(False)  # True for random shuffle
-    formatted_wavfiles = format_wav_list(data_list)
-    with open('/work/data/manifests/pretrain/hindi_21_20000to4000_ATDS_reverse.tsv', 'w', encoding='utf-8') as f:
-        f.write(formatted_wavfiles)
+    data_rows = sort_atds(False)  # True for random shuffle
+    write_manifest(data_rows, '/work/data/manifests/pretrain/hindi_21_20000to4000_ATDS_reverse.tsv')
 
@@ -0,0 +1,94 @@
+import os
+from itertools import chain
+
+import numpy as np
+
+# Cluster id i is written as chr(i + CHAR_OFFSET) in the unit strings fed to SentencePiece
+CHAR_OFFSET = 34
+
+def collapse_runs(cluster_ids, offsets):
+    """
+    Merge repeated consecutive units within each utterance, like the
+    (.)\\1+ -> \\1 substitution of make_all_utts_df.
+
+    Parameters:
+    cluster_ids (np.ndarray): cluster ids of all utterances, concatenated
+    offsets (np.ndarray): start of each utterance in cluster_ids, plus the total length at the end
+
+    Returns:
+    tuple: (collapsed cluster ids, their offsets)
+    """
+    cluster_ids = np.asarray(cluster_ids)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    # Keep a unit if it differs from the previous one or starts an utterance
+    keep = np.ones(len(cluster_ids), dtype=bool)
+    keep[1:] = cluster_ids[1:] != cluster_ids[:-1]
+    starts = offsets[:-1]
+    keep[starts[starts < len(cluster_ids)]] = True
+
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    return cluster_ids[keep], kept_before[offsets]
+
+def unit_strings(cluster_ids, offsets, collapse=True):
+    """
+    Unit string of every utterance, built with one vectorized character
+    mapping instead of a chr() call per frame.
+
+    Returns:
+    list of str: one unit string per utterance
+    """
+    if collapse:
+        cluster_ids, offsets = collapse_runs(cluster_ids, offsets)
+    text = (np.asarray(cluster_ids) + CHAR_OFFSET).astype("<u4").tobytes().decode("utf-32-le")
+    return [text[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+def utterance_offsets(clusters_df, keys=("lang", "wav_file")):
+    """
+    Gather the rows of a clusters DataFrame (one row per code) into
+    utterances, the way groupby(keys) does: sorted by the keys, rows of an
+    utterance kept in their original order.
+
+    Returns:
+    tuple: (DataFrame of the utterance keys, cluster ids in utterance order, offsets)
+    """
+    keys = list(keys)
+    clusters_df = clusters_df.sort_values(keys, kind="stable")
+    key_values = [clusters_df[k].to_numpy() for k in keys]
+
+    is_start = np.zeros(len(clusters_df), dtype=bool)
+    is_start[:1] = True
+    for values in key_values:
+        is_start[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(is_start)
+
+    utt_df = clusters_df[keys].iloc[starts].reset_index(drop=True)
+    return utt_df, clusters_df.cluster_id.to_numpy(), np.append(starts, len(clusters_df))
+
+# Unit strings per SentencePiece call; each call is split over num_threads threads
+ENCODE_BATCH_SIZE = 10_000
+
+def encode_units(sp, units, num_threads=None, batch_size=ENCODE_BATCH_SIZE):
+    """
+    SentencePiece-encode unit strings in large multi-threaded batches.
+
+    Parameters:
+    sp (spm.SentencePieceProcessor): unit tokenizer
+    units (list of str): unit string of each utterance
+    num_threads (int): encoder threads (default: all cores)
+
+    Returns:
+    tuple: (flat int32 piece ids of all utterances, int64 offsets of each utterance plus the total)
+    """
+    num_threads = num_threads or os.cpu_count()
+    lengths = np.zeros(len(units), dtype=np.int64)
+    batches = []
+
+    for start in range(0, len(units), batch_size):
+        encoded = sp.encode(list(units[start:start + batch_size]), out_type=int, num_threads=num_threads)
+        batch_lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        lengths[start:start + len(encoded)] = batch_lengths
+        batches.append(np.fromiter(chain.from_iterable(encoded), dtype=np.int32, count=int(batch_lengths.sum())))
+
+    piece_ids = np.concatenate(batches) if batches else np.empty(0, dtype=np.int32)
+    return piece_ids, np.concatenate([[0], np.cumsum(lengths)])
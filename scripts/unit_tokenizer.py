@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+
+import pandas as pd
+import sentencepiece as spm
+
+from embedding_cache import file_sha256
+from unit_strings import utterance_offsets, unit_strings
+
+# Trainer settings of the original __main__ blocks
+SPM_PARAMS = {
+    "vocab_size": 10001,
+    "character_coverage": 1.0,
+    "model_type": "unigram",
+    "bos_id": -1,
+    "eos_id": -1,
+}
+# Sentences sampled for training; the full reference can be far larger
+INPUT_SENTENCE_SIZE = 1_000_000
+
+def write_training_text(clustered_parquet, text_path):
+    """
+    Write the unit string of every utterance of a clustered parquet
+    (wav_file, cluster_id), one per line, as tgt_utts.txt used to be.
+    """
+    clusters_df = pd.read_parquet(clustered_parquet, columns=["wav_file", "cluster_id"])
+    _, cluster_ids, offsets = utterance_offsets(clusters_df, keys=["wav_file"])
+
+    tmp_path = text_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(unit_strings(cluster_ids, offsets)) + "\n")
+    os.replace(tmp_path, text_path)
+
+def train_unit_tokenizer(text_path, model_prefix, ident_norm=False, input_sentence_size=INPUT_SENTENCE_SIZE,
+                         num_threads=None, seed=0):
+    """
+    Train a SentencePiece unit tokenizer, unless <model_prefix>.model was
+    already trained on the same text with the same settings. The input hash
+    and settings are kept in <model_prefix>.json next to the model.
+
+    Returns:
+    str: path of the model file
+    """
+    params = dict(SPM_PARAMS,
+                  normalization_rule_name='identity' if ident_norm else 'nmt_nfkc',
+                  input_sentence_size=input_sentence_size,
+                  shuffle_input_sentence=True,
+                  seed=seed)
+    stamp = {"input_sha256": file_sha256(text_path), "params": params}
+    model_file = model_prefix + ".model"
+    stamp_file = model_prefix + ".json"
+
+    if os.path.exists(model_file) and os.path.exists(stamp_file):
+        with open(stamp_file) as f:
+            if json.load(f) == stamp:
+                print(f"{model_file} is up to date, skipping training")
+                return model_file
+
+    # Fixed seed, so the sentence sampling gives the same model for the same input
+    spm.set_random_generator_seed(seed)
+    trainer_params = {k: v for k, v in params.items() if k != "seed"}
+    spm.SentencePieceTrainer.train(input=text_path, model_prefix=model_prefix,
+                                   num_threads=num_threads or os.cpu_count(), **trainer_params)
+
+    with open(stamp_file, "w") as f:
+        json.dump(stamp, f, indent=2)
+    return model_file
+
+def build_unit_tokenizer(clustered_parquet, model_prefix, ident_norm=False, **kwargs):
+    """
+    Tokenizer stage: training text from the reference language's clustered
+    parquet, then a cached train_unit_tokenizer.
+
+    Returns:
+    spm.SentencePieceProcessor
+    """
+    text_path = model_prefix + ".txt"
+    write_training_text(clustered_parquet, text_path)
+    model_file = train_unit_tokenizer(text_path, model_prefix, ident_norm=ident_norm, **kwargs)
+    return spm.SentencePieceProcessor(model_file=model_file)
+
+if __name__ == "__main__":
+    # python unit_tokenizer.py <lang>_clustered.parquet <model_prefix>
+    build_unit_tokenizer(sys.argv[1], sys.argv[2])
@@ -0,0 +1,128 @@
+import argparse
+
+import numpy as np
+
+from atds_scoring import atds_scores
+from corpus_atds import UtteranceHistograms
+from group_selection import write_manifest
+from reference_histogram import ReferenceHistogram
+
+def utterance_scores(corpus, ref_histogram):
+    """
+    ATDS of every utterance of the pool on its own.
+
+    Returns:
+    pd.DataFrame: wav_file, num_frames, piece_counts_sum and atds per utterance
+    """
+    scores_df = corpus.utterances[["wav_file", "num_frames"]].copy()
+    scores_df["piece_counts_sum"] = np.asarray(corpus.histograms.sum(axis=1)).ravel()
+    scores_df["atds"] = atds_scores(corpus.histograms, ref_histogram)
+    return scores_df
+
+class GreedySelector:
+    """
+    Grow a file-level selection that maximizes the ATDS of the selection's
+    summed piece histogram against the reference.
+
+    ATDS is a cosine, so normalizing to the most frequent piece does not
+    change it, and the ATDS of the selection plus one candidate only needs
+    the candidate's dot products with the reference and with the current
+    selection. The latter are kept up to date for all candidates, so a step
+    costs one pass over the pool instead of rescoring every candidate group.
+    """
+
+    def __init__(self, histograms, ref_histogram):
+        self.histograms = histograms.tocsr().astype(np.float64)
+        self.histograms_csc = self.histograms.tocsc()
+        ref = ref_histogram / ref_histogram.max()
+        self.ref_norm = np.sqrt(np.dot(ref, ref))
+
+        # Per candidate: h.r, h.h and h.S for the current selection S
+        self.ref_dots = self.histograms @ ref
+        self.sq_norms = np.asarray(self.histograms.multiply(self.histograms).sum(axis=1)).ravel()
+        self.selection_dots = np.zeros(self.histograms.shape[0])
+
+        # Of the selection: S.r and S.S
+        self.ref_dot = 0.0
+        self.sq_norm = 0.0
+
+    def atds(self):
+        """ATDS of the current selection (nan while it is empty)."""
+        if self.sq_norm == 0:
+            return np.nan
+        return self.ref_dot / (np.sqrt(self.sq_norm) * self.ref_norm)
+
+    def marginal_gains(self):
+        """Change of the selection's ATDS when each utterance is added to it."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new_atds = (self.ref_dot + self.ref_dots) / (
+                np.sqrt(self.sq_norm + 2 * self.selection_dots + self.sq_norms) * self.ref_norm)
+        return new_atds - (0.0 if self.sq_norm == 0 else self.atds())
+
+    def add(self, idx):
+        row = self.histograms[idx]
+        self.ref_dot += self.ref_dots[idx]
+        self.sq_norm += 2 * self.selection_dots[idx] + self.sq_norms[idx]
+        self.selection_dots += self.histograms_csc[:, row.indices] @ row.data
+
+def greedy_select(corpus, ref_histogram, num_hours, min_gain=None):
+    """
+    Pick utterances one at a time, always the one with the largest marginal
+    gain that still fits into num_hours, until nothing fits (or, with
+    min_gain, until the best gain drops below it). Utterances without
+    pieces are never picked.
+
+    Returns:
+    pd.DataFrame: selected wav_file, num_frames, gain and the selection's atds after each step
+    """
+    num_frames = corpus.utterances.num_frames.to_numpy()
+    remaining = int(16_000 * 60 * 60 * num_hours)
+    selector = GreedySelector(corpus.histograms, ref_histogram)
+    available = selector.sq_norms > 0
+
+    selected = []
+    while True:
+        candidates = available & (num_frames <= remaining)
+        if not candidates.any():
+            break
+        gains = np.where(candidates, selector.marginal_gains(), -np.inf)
+        idx = int(np.argmax(gains))
+        if min_gain is not None and gains[idx] < min_gain:
+            break
+
+        selector.add(idx)
+        available[idx] = False
+        remaining -= num_frames[idx]
+        selected.append((idx, gains[idx], selector.atds()))
+
+    selection_df = corpus.utterances.iloc[[idx for idx, _, _ in selected]][["wav_file", "num_frames"]].reset_index(drop=True)
+    selection_df["gain"] = [gain for _, gain, _ in selected]
+    selection_df["atds"] = [atds for _, _, atds in selected]
+    return selection_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-utterance ATDS scores and greedy file-level selection under an hours budget')
+    parser.add_argument('--histograms', required=True, type=str, help='output dir of corpus_atds.py build')
+    parser.add_argument('--reference', required=True, type=str, help='reference histogram .npz')
+    parser.add_argument('--num-hours', default=None, type=float,
+                help='hours to select greedily; without it only the per-utterance scores are written')
+    parser.add_argument('--min-gain', default=None, type=float,
+                help='optional. Stop selecting once the best marginal gain is below this')
+    parser.add_argument('--scores-csv', default=None, type=str, help='optional. Write per-utterance ATDS here')
+    parser.add_argument('--output-tsv', default=None, type=str, help='manifest of the selected files (path<TAB>num_frames)')
+    args = parser.parse_args()
+
+    corpus = UtteranceHistograms(args.histograms)
+    reference = ReferenceHistogram(args.reference)
+
+    if args.scores_csv is not None:
+        utterance_scores(corpus, reference.histogram).to_csv(args.scores_csv, index=False)
+        print(f"Saved per-utterance scores to {args.scores_csv}")
+
+    if args.num_hours is not None:
+        selection_df = greedy_select(corpus, reference.histogram, args.num_hours, args.min_gain)
+        print(f"Selected {len(selection_df)} files, {selection_df.num_frames.sum() / 16000 / 60 / 60:.4f} hours, "
+              f"ATDS {selection_df.atds.iloc[-1] if len(selection_df) else float('nan'):.4f}")
+        if args.output_tsv is not None:
+            num_files = write_manifest(selection_df.rename(columns={"wav_file": "path"}), args.output_tsv)
+            print(f"Saved {num_files} files to {args.output_tsv}")